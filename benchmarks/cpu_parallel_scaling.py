@@ -0,0 +1,78 @@
+"""
+Scaling benchmark of updaters.CPUParallelUpdater.
+
+Trains PointNetAE on random point clouds with 1 to N processes and prints
+iterations/sec for each process count. The global batch size is kept
+fixed, so each process gets batchsize // processes examples.
+
+    OMP_NUM_THREADS=1 python benchmarks/cpu_parallel_scaling.py -p 8
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import chainer
+from chainer import iterators
+from chainer import optimizers
+from chainer import training
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+import models.pointnet_ae as ae
+import updaters
+
+
+def make_dataset(size, num_point):
+    x = np.random.uniform(-1, 1, (size, 3, num_point, 1)).astype(np.float32)
+    label = np.zeros(size, dtype=np.int32)
+    return chainer.datasets.TupleDataset(x, label)
+
+
+def measure(processes, train, batch_size, num_point, iteration, warmup):
+    model = ae.PointNetAE(out_dim=3, output_points=num_point)
+    optimizer = optimizers.Adam()
+    optimizer.setup(model)
+    if processes > 1:
+        shards = chainer.datasets.split_dataset_n_random(train, processes)
+        train_iters = [iterators.SerialIterator(shard, batch_size // processes)
+                       for shard in shards]
+        updater = updaters.CPUParallelUpdater(train_iters, optimizer)
+    else:
+        train_iter = iterators.SerialIterator(train, batch_size)
+        updater = training.StandardUpdater(train_iter, optimizer)
+
+    for _ in range(warmup):
+        updater.update()
+    start = time.time()
+    for _ in range(iteration):
+        updater.update()
+    elapsed = time.time() - start
+    updater.finalize()
+    return iteration / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='CPU data parallel scaling benchmark')
+    parser.add_argument('--processes', '-p', type=int, default=4)
+    parser.add_argument('--batchsize', '-b', type=int, default=32)
+    parser.add_argument('--num_point', '-n', type=int, default=1024)
+    parser.add_argument('--iteration', '-i', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    args = parser.parse_args()
+
+    train = make_dataset(args.batchsize * 8, args.num_point)
+    base = None
+    print('processes  iter/sec  speedup')
+    for processes in range(1, args.processes + 1):
+        ips = measure(processes, train, args.batchsize, args.num_point,
+                      args.iteration, args.warmup)
+        if base is None:
+            base = ips
+        print('{:9d}  {:8.3f}  {:7.2f}'.format(processes, ips, ips / base))
+
+
+if __name__ == '__main__':
+    main()
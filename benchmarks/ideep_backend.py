@@ -0,0 +1,80 @@
+"""
+NumPy vs iDeep training and inference speed of PointNetAE.
+
+Trains on random point clouds with the NumPy backend and with
+``--device intel64`` (see devices.py) and prints training iterations/sec
+and inference clouds/sec for each batch size. iDeep is skipped when
+ideep4py isn't installed.
+
+    python benchmarks/ideep_backend.py -b 8,32 -n 1024
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import chainer
+from chainer import iterators
+from chainer import optimizers
+from chainer import training
+from chainer.dataset.convert import concat_examples
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import models.pointnet_ae as ae
+import devices
+from cpu_parallel_scaling import make_dataset
+
+
+def measure(backend, train, batch_size, num_point, iteration, warmup):
+    chainer.global_config.use_ideep = 'never'
+    model = ae.PointNetAE(out_dim=3, output_points=num_point)
+    devices.setup_device(model, -1, backend)
+    optimizer = optimizers.Adam()
+    optimizer.setup(model)
+    updater = training.StandardUpdater(
+        iterators.SerialIterator(train, batch_size), optimizer)
+    for _ in range(warmup):
+        updater.update()
+    start = time.time()
+    for _ in range(iteration):
+        updater.update()
+    train_ips = iteration / (time.time() - start)
+
+    x, _ = concat_examples(train[:batch_size])
+    with chainer.using_config('train', False), chainer.no_backprop_mode():
+        model.calc(x)
+        start = time.time()
+        for _ in range(iteration):
+            model.calc(x)
+    infer_cps = iteration * batch_size / (time.time() - start)
+    return train_ips, infer_cps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NumPy vs iDeep benchmark')
+    parser.add_argument('--batchsize', '-b', type=str, default='8,32')
+    parser.add_argument('--num_point', '-n', type=int, default=1024)
+    parser.add_argument('--iteration', '-i', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    args = parser.parse_args()
+
+    backends = ['numpy']
+    if devices.intel64_available():
+        backends.append('intel64')
+    else:
+        print('ideep4py is not installed, only numpy is measured')
+
+    print('{:<8} {:>6} {:>10} {:>12}'.format('backend', 'batch', 'iter/sec', 'clouds/sec'))
+    for batch_size in [int(v) for v in args.batchsize.split(',')]:
+        train = make_dataset(batch_size * 4, args.num_point)
+        for backend in backends:
+            ips, cps = measure(backend, train, batch_size, args.num_point,
+                               args.iteration, args.warmup)
+            print('{:<8} {:>6} {:>10.3f} {:>12.1f}'.format(backend, batch_size, ips, cps))
+
+
+if __name__ == '__main__':
+    main()
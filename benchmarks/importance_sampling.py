@@ -0,0 +1,100 @@
+"""
+Time to a target validation dist_loss with uniform vs importance sampling.
+
+Trains PointNetAE on a synthetic ShapeNet fixture (see train_throughput.py)
+with SerialIterator and with samplers.ImportanceSamplingIterator, evaluates
+the validation split every --eval_every iterations and prints the wall
+time and iterations needed to reach --target.
+
+    python benchmarks/importance_sampling.py -n 256 --target 5
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import chainer
+from chainer import iterators
+from chainer import optimizers
+from chainer import training
+from chainer.dataset.convert import concat_examples
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import models.pointnet_ae as ae
+import dataset
+import samplers
+from train_throughput import make_fixture
+
+
+def val_loss(model, val, batch_size):
+    losses = []
+    with chainer.using_config('train', False), chainer.no_backprop_mode():
+        for i in range(0, len(val), batch_size):
+            x, _ = concat_examples([val[j] for j in range(i, min(i + batch_size, len(val)))])
+            y, _, _ = model.calc(x)
+            losses.append(ae.calc_chamfer_distance_per_sample(y, x).array)
+    return float(np.concatenate(losses).mean())
+
+
+def run(mode, train, val, args):
+    np.random.seed(args.seed)
+    model = ae.PointNetAE(out_dim=3, output_points=args.num_point)
+    optimizer = optimizers.Adam()
+    optimizer.setup(model)
+    if mode == 'importance':
+        it = samplers.ImportanceSamplingIterator(
+            train, args.batchsize, model, warmup=args.warmup, floor=args.floor)
+    else:
+        it = iterators.SerialIterator(train, args.batchsize)
+    updater = training.StandardUpdater(it, optimizer, converter=concat_examples)
+
+    elapsed = 0.
+    loss = None
+    for iteration in range(1, args.max_iteration + 1):
+        start = time.time()
+        updater.update()
+        elapsed += time.time() - start
+        if iteration % args.eval_every == 0:
+            loss = val_loss(model, val, args.batchsize)
+            if loss <= args.target:
+                return iteration, elapsed, loss
+    return None, elapsed, loss
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Importance sampling time to target benchmark')
+    parser.add_argument('--batchsize', '-b', type=int, default=16)
+    parser.add_argument('--num_point', '-n', type=int, default=256)
+    parser.add_argument('--shapes', type=int, default=64,
+                        help='shapes per class and split')
+    parser.add_argument('--target', type=float, default=5.0)
+    parser.add_argument('--max_iteration', type=int, default=3000)
+    parser.add_argument('--eval_every', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--floor', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='shapenet_fixture_')
+    try:
+        make_fixture(root, args.shapes)
+        train = dataset.ChainerPointCloudDatasetDefault(root=root, split='train', num_point=args.num_point)
+        val = dataset.ChainerPointCloudDatasetDefault(root=root, split='val', num_point=args.num_point)
+    finally:
+        shutil.rmtree(root)
+
+    print('{:<11} {:>10} {:>10} {:>10}'.format('sampling', 'iteration', 'sec', 'val_loss'))
+    for mode in ('uniform', 'importance'):
+        iteration, elapsed, loss = run(mode, train, val, args)
+        print('{:<11} {:>10} {:>10.1f} {:>10.4f}'.format(
+            mode, iteration if iteration else 'not reached', elapsed, loss))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Training time of padded vs packed batches of clouds of different sizes.
+
+The synthetic ShapeNet fixture (see train_throughput.py) is generated with
+--min_points to --max_points points per shape. Padded batches resample
+every cloud to --num_point points, packed batches concatenate the clouds
+of their own size (see models/packed.py). Prints the seconds per
+iteration and the points computed per batch of each mode.
+
+    python benchmarks/packed_batches.py -b 16 -n 1024 --min_points 200 --max_points 1024
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import chainer
+from chainer import iterators
+from chainer import optimizers
+from chainer import training
+from chainer.dataset.convert import concat_examples
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import models.pointnet_ae as ae
+import dataset
+from train_throughput import make_fixture
+
+
+def run(mode, train, args):
+    np.random.seed(args.seed)
+    model = ae.PointNetAE(out_dim=3, output_points=args.num_point)
+    optimizer = optimizers.Adam()
+    optimizer.setup(model)
+    converter = dataset.concat_packed if mode == 'packed' else concat_examples
+    it = iterators.SerialIterator(train, args.batchsize)
+    updater = training.StandardUpdater(it, optimizer, converter=converter)
+
+    # the first iteration allocates the arrays
+    updater.update()
+    start = time.time()
+    for _ in range(args.iteration):
+        updater.update()
+    return (time.time() - start) / args.iteration
+
+
+def points_per_batch(mode, train, args):
+    if mode == 'packed':
+        return np.mean([train[i][0].shape[1] for i in range(len(train))]) * args.batchsize
+    return args.num_point * args.batchsize
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Padded vs packed batches benchmark')
+    parser.add_argument('--batchsize', '-b', type=int, default=16)
+    parser.add_argument('--num_point', '-n', type=int, default=1024)
+    parser.add_argument('--min_points', type=int, default=200)
+    parser.add_argument('--max_points', type=int, default=1024)
+    parser.add_argument('--shapes', type=int, default=32,
+                        help='shapes per class and split')
+    parser.add_argument('--iteration', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='shapenet_fixture_')
+    try:
+        make_fixture(root, args.shapes, min_points=args.min_points, max_points=args.max_points)
+        datasets = {
+            'padded': dataset.ChainerPointCloudDatasetDefault(
+                root=root, split='train', num_point=args.num_point),
+            'packed': dataset.ChainerPointCloudDatasetDefault(
+                root=root, split='train', num_point=args.num_point, variable_size=True)}
+    finally:
+        shutil.rmtree(root)
+
+    print('{:<8} {:>12} {:>10}'.format('batch', 'points/batch', 'sec/iter'))
+    for mode in ('padded', 'packed'):
+        train = datasets[mode]
+        sec = run(mode, train, args)
+        print('{:<8} {:>12.0f} {:>10.3f}'.format(mode, points_per_batch(mode, train, args), sec))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Time to a target validation dist_loss with a fixed point count vs the
+progressive point count curriculum.
+
+Trains PointNetAE on a synthetic ShapeNet fixture (see train_throughput.py)
+with all --num_point points from the start, and with training points
+ramped from --start to --num_point over --ramp_epochs (see
+extensions.PointCurriculum). The validation split is always evaluated with
+all the points every --eval_every iterations, and the wall time and
+iterations needed to reach --target are printed.
+
+    python benchmarks/point_curriculum.py -n 1024 --start 256 --target 5
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import chainer
+from chainer import iterators
+from chainer import optimizers
+from chainer import training
+from chainer.dataset.convert import concat_examples
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import models.pointnet_ae as ae
+import dataset
+import extensions
+from train_throughput import make_fixture
+from importance_sampling import val_loss
+
+
+def run(mode, train, val, args):
+    np.random.seed(args.seed)
+    model = ae.PointNetAE(out_dim=3, output_points=args.num_point)
+    optimizer = optimizers.Adam()
+    optimizer.setup(model)
+    it = iterators.SerialIterator(train, args.batchsize)
+    updater = training.StandardUpdater(it, optimizer, converter=concat_examples)
+
+    elapsed = 0.
+    loss = None
+    for iteration in range(1, args.max_iteration + 1):
+        if mode == 'curriculum':
+            points = extensions.curriculum_points(
+                it.epoch_detail, args.start, args.num_point, args.ramp_epochs)
+            model.train_points = None if points >= args.num_point else points
+        start = time.time()
+        updater.update()
+        elapsed += time.time() - start
+        if iteration % args.eval_every == 0:
+            loss = val_loss(model, val, args.batchsize)
+            if loss <= args.target:
+                return iteration, elapsed, loss
+    return None, elapsed, loss
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Point count curriculum time to target benchmark')
+    parser.add_argument('--batchsize', '-b', type=int, default=16)
+    parser.add_argument('--num_point', '-n', type=int, default=1024)
+    parser.add_argument('--start', type=int, default=256)
+    parser.add_argument('--ramp_epochs', type=int, default=20)
+    parser.add_argument('--shapes', type=int, default=64,
+                        help='shapes per class and split')
+    parser.add_argument('--target', type=float, default=5.0)
+    parser.add_argument('--max_iteration', type=int, default=3000)
+    parser.add_argument('--eval_every', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='shapenet_fixture_')
+    try:
+        make_fixture(root, args.shapes)
+        train = dataset.ChainerPointCloudDatasetDefault(root=root, split='train', num_point=args.num_point)
+        val = dataset.ChainerPointCloudDatasetDefault(root=root, split='val', num_point=args.num_point)
+    finally:
+        shutil.rmtree(root)
+
+    print('{:<11} {:>10} {:>10} {:>10}'.format('points', 'iteration', 'sec', 'val_loss'))
+    for mode in ('fixed', 'curriculum'):
+        iteration, elapsed, loss = run(mode, train, val, args)
+        print('{:<11} {:>10} {:>10.1f} {:>10.4f}'.format(
+            mode, iteration if iteration else 'not reached', elapsed, loss))
+
+
+if __name__ == '__main__':
+    main()
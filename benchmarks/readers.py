@@ -0,0 +1,92 @@
+"""
+Benchmark of point_io readers against np.loadtxt and open3d.
+
+Writes random clouds as ASCII .pts/.seg, binary PCD and binary PLY files
+to a temporary directory and prints the mean read time per file for each
+reader. open3d is skipped when it isn't installed.
+
+    python benchmarks/readers.py -f 50 -n 3000
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+import point_io
+
+
+def write_pcd(path, points):
+    header = ('# .PCD v0.7 - Point Cloud Data file format\n'
+              'VERSION 0.7\nFIELDS x y z\nSIZE 4 4 4\nTYPE F F F\nCOUNT 1 1 1\n'
+              'WIDTH {0}\nHEIGHT 1\nVIEWPOINT 0 0 0 1 0 0 0\nPOINTS {0}\nDATA binary\n'
+              .format(len(points)))
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        f.write(points.astype('<f4').tobytes())
+
+
+def write_ply(path, points):
+    header = ('ply\nformat binary_little_endian 1.0\nelement vertex {}\n'
+              'property float x\nproperty float y\nproperty float z\nend_header\n'
+              .format(len(points)))
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        f.write(points.astype('<f4').tobytes())
+
+
+def measure(func, paths):
+    start = time.time()
+    for path in paths:
+        func(path)
+    return (time.time() - start) / len(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Point cloud reader benchmark')
+    parser.add_argument('--files', '-f', type=int, default=50)
+    parser.add_argument('--num_point', '-n', type=int, default=3000)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='point_io_bench_')
+    try:
+        files = {'pts': [], 'seg': [], 'pcd': [], 'ply': []}
+        for i in range(args.files):
+            points = np.random.uniform(-1, 1, (args.num_point, 3)).astype(np.float32)
+            base = os.path.join(root, str(i))
+            np.savetxt(base + '.pts', points, fmt='%.5f')
+            np.savetxt(base + '.seg', np.random.randint(1, 5, args.num_point), fmt='%d')
+            write_pcd(base + '.pcd', points)
+            write_ply(base + '.ply', points)
+            for ext in files:
+                files[ext].append(base + '.' + ext)
+
+        benches = [
+            ('pts', 'np.loadtxt', lambda p: np.loadtxt(p).astype(np.float32)),
+            ('pts', 'point_io.read_pts', point_io.read_pts),
+            ('seg', 'np.loadtxt', lambda p: np.loadtxt(p).astype(np.int64)),
+            ('seg', 'point_io.read_seg', point_io.read_seg),
+            ('pcd', 'point_io.read_pcd', lambda p: np.array(point_io.read_pcd(p))),
+            ('ply', 'point_io.read_ply', lambda p: np.array(point_io.read_ply(p))),
+        ]
+        try:
+            import open3d.open3d as open3d
+            for ext in ('pcd', 'ply'):
+                benches.append((ext, 'open3d', lambda p: np.asarray(open3d.read_point_cloud(p).points)))
+        except ImportError:
+            print('open3d is not installed, skipped')
+
+        print('{:<5} {:<20} {:>12}'.format('file', 'reader', 'ms/file'))
+        for ext, name, func in benches:
+            print('{:<5} {:<20} {:>12.3f}'.format(ext, name, measure(func, files[ext]) * 1000))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
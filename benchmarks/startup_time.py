@@ -0,0 +1,61 @@
+"""
+Startup time benchmark of the entry points.
+
+Runs each entry point with --help (which exits right after argument
+parsing) and a few bare module imports in fresh interpreters, and prints
+the best wall time of several runs. Use `python -X importtime` on a
+single command to see which import dominates.
+
+    python benchmarks/startup_time.py -r 5
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [
+    ('python (baseline)', ['-c', 'pass']),
+    ('train.py --help', ['train.py', '--help']),
+    ('test.py --help', ['test.py', '--help']),
+    ('dataset.py --help', ['dataset.py', '--help']),
+    ('serve.py --help', ['serve.py', '--help']),
+    ('import dataset', ['-c', 'import dataset']),
+    ('import provider', ['-c', 'import provider']),
+    ('import utils.show3d_balls', ['-c', 'import utils.show3d_balls']),
+    ('import models.pointnet_ae', ['-c', 'import models.pointnet_ae']),
+]
+
+
+def measure(argv, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        ret = subprocess.call([sys.executable] + argv, cwd=BASE_DIR,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+        elapsed = time.time() - start
+        if ret != 0:
+            return None
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time benchmark')
+    parser.add_argument('--repeat', '-r', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:<28} {:>10}'.format('command', 'sec'))
+    for name, argv in COMMANDS:
+        elapsed = measure(argv, args.repeat)
+        if elapsed is None:
+            print('{:<28} {:>10}'.format(name, 'failed'))
+        else:
+            print('{:<28} {:>10.3f}'.format(name, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Speed and quality of the stochastic Chamfer distance.
+
+First times the forward and backward of calc_chamfer_distance_loss with
+the exact distance and with random subsets of --sample_points points per
+cloud for each --output_points. Then trains PointNetAE on a synthetic
+ShapeNet fixture (see train_throughput.py) for --iterations with the exact
+and the stochastic training loss, and prints the training time and the
+exact validation dist_loss of both.
+
+    python benchmarks/stochastic_chamfer.py --output_points 1024,2048 --sample_points 256,512
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import chainer
+from chainer import iterators
+from chainer import optimizers
+from chainer import training
+from chainer.dataset.convert import concat_examples
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import models.pointnet_ae as ae
+import dataset
+from train_throughput import make_fixture
+from importance_sampling import val_loss
+
+
+def time_loss(batch_size, num_point, sample_points, repeat):
+    label = np.random.uniform(-1, 1, (batch_size, 3, num_point, 1)).astype(np.float32)
+    pred = chainer.Variable(
+        np.random.uniform(-1, 1, (batch_size, 3, num_point, 1)).astype(np.float32))
+    elapsed = []
+    for _ in range(repeat):
+        start = time.time()
+        loss = ae.calc_chamfer_distance_loss(pred, label, sample_points)
+        pred.cleargrad()
+        loss.backward()
+        elapsed.append(time.time() - start)
+    return min(elapsed)
+
+
+def train(train_data, val_data, args, sample_points):
+    np.random.seed(args.seed)
+    model = ae.PointNetAE(out_dim=3, output_points=args.num_point)
+    model.chamfer_points = sample_points
+    optimizer = optimizers.Adam()
+    optimizer.setup(model)
+    it = iterators.SerialIterator(train_data, args.batchsize)
+    updater = training.StandardUpdater(it, optimizer, converter=concat_examples)
+    start = time.time()
+    for _ in range(args.iterations):
+        updater.update()
+    elapsed = time.time() - start
+    return elapsed, val_loss(model, val_data, args.batchsize)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stochastic Chamfer benchmark')
+    parser.add_argument('--batchsize', '-b', type=int, default=16)
+    parser.add_argument('--output_points', type=str, default='1024,2048')
+    parser.add_argument('--sample_points', type=str, default='256,512')
+    parser.add_argument('--repeat', '-r', type=int, default=3)
+    parser.add_argument('--num_point', '-n', type=int, default=1024,
+                        help='points of the training comparison')
+    parser.add_argument('--iterations', type=int, default=200,
+                        help='training iterations, 0 skips the training comparison')
+    parser.add_argument('--shapes', type=int, default=16,
+                        help='shapes per class and split')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    output_points = [int(v) for v in args.output_points.split(',')]
+    sample_points = [int(v) for v in args.sample_points.split(',')]
+
+    print('{:>8} {:>8} {:>10} {:>8}'.format('points', 'sampled', 'ms', 'speedup'))
+    for n in output_points:
+        exact = time_loss(args.batchsize, n, None, args.repeat)
+        print('{:>8} {:>8} {:>10.1f} {:>8.1f}'.format(n, 'exact', exact * 1000, 1.))
+        for k in sample_points:
+            if k < n:
+                t = time_loss(args.batchsize, n, k, args.repeat)
+                print('{:>8} {:>8} {:>10.1f} {:>8.1f}'.format(n, k, t * 1000, exact / t))
+
+    if args.iterations <= 0:
+        return
+    root = tempfile.mkdtemp(prefix='shapenet_fixture_')
+    try:
+        make_fixture(root, args.shapes)
+        train_data = dataset.ChainerPointCloudDatasetDefault(root=root, split='train', num_point=args.num_point)
+        val_data = dataset.ChainerPointCloudDatasetDefault(root=root, split='val', num_point=args.num_point)
+    finally:
+        shutil.rmtree(root)
+
+    print('\n{:>8} {:>10} {:>16}'.format('sampled', 'train sec', 'exact val_loss'))
+    for k in [None] + [k for k in sample_points if k < args.num_point]:
+        elapsed, loss = train(train_data, val_data, args, k)
+        print('{:>8} {:>10.1f} {:>16.4f}'.format(k or 'exact', elapsed, loss))
+
+
+if __name__ == '__main__':
+    main()
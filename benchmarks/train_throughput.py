@@ -0,0 +1,163 @@
+"""
+End-to-end training throughput benchmark on a synthetic ShapeNet fixture.
+
+A small dataset is generated in the shapenetcore_partanno_segmentation_benchmark_v0
+layout (synsetoffset2category.txt, train_test_split/*.json, points/*.pts,
+points_label/*.seg), so no download is needed. For each num_point, the
+dataset construction is timed, then for each batch size the iterator and
+converter throughput and a fixed number of PointNetAE training iterations.
+Results are printed and written as JSON to compare across commits.
+
+    python benchmarks/train_throughput.py -b 8,32 -n 512,1024 -o bench.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+import chainer
+from chainer import iterators
+from chainer import optimizers
+from chainer import training
+from chainer.dataset.convert import concat_examples
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+import models.pointnet_ae as ae
+import dataset
+
+SYNSETS = {'Airplane': '02691156', 'Chair': '03001627', 'Table': '04379243'}
+
+
+def make_fixture(root, shapes_per_split=32, min_points=1500, max_points=3000,
+                 seed=0):
+    """Write a synthetic dataset in the ShapeNetPart layout under ``root``"""
+    rs = np.random.RandomState(seed)
+    os.makedirs(os.path.join(root, 'train_test_split'), exist_ok=True)
+    with open(os.path.join(root, 'synsetoffset2category.txt'), 'w') as f:
+        for name, synset in sorted(SYNSETS.items()):
+            f.write('{}\t{}\n'.format(name, synset))
+
+    splits = {'train': [], 'val': [], 'test': []}
+    for name, synset in sorted(SYNSETS.items()):
+        dir_point = os.path.join(root, synset, 'points')
+        dir_seg = os.path.join(root, synset, 'points_label')
+        os.makedirs(dir_point, exist_ok=True)
+        os.makedirs(dir_seg, exist_ok=True)
+        for split in sorted(splits):
+            for i in range(shapes_per_split):
+                token = '{}_{}_{:05d}'.format(synset, split, i)
+                n = rs.randint(min_points, max_points)
+                # noisy ellipsoid surfaces
+                points = rs.normal(size=(n, 3))
+                points /= np.linalg.norm(points, axis=1, keepdims=True)
+                points *= rs.uniform(0.2, 1.0, size=3)
+                points += rs.normal(scale=0.01, size=(n, 3))
+                seg = rs.randint(1, 5, size=n)
+                np.savetxt(os.path.join(dir_point, token + '.pts'), points, fmt='%.5f')
+                np.savetxt(os.path.join(dir_seg, token + '.seg'), seg, fmt='%d')
+                splits[split].append('shape_data/{}/{}'.format(synset, token))
+
+    for split, ids in splits.items():
+        fn = 'shuffled_{}_file_list.json'.format(split)
+        with open(os.path.join(root, 'train_test_split', fn), 'w') as f:
+            json.dump(ids, f)
+    return root
+
+
+def bench_iterator(train, batch_size, n_batches):
+    it = iterators.SerialIterator(train, batch_size)
+    start = time.time()
+    for _ in range(n_batches):
+        concat_examples(it.next())
+    elapsed = time.time() - start
+    return n_batches * batch_size / elapsed
+
+
+def bench_training(train, batch_size, num_point, iteration, warmup):
+    model = ae.PointNetAE(out_dim=3, output_points=num_point)
+    optimizer = optimizers.Adam()
+    optimizer.setup(model)
+    it = iterators.SerialIterator(train, batch_size)
+    updater = training.StandardUpdater(it, optimizer, converter=concat_examples)
+    for _ in range(warmup):
+        updater.update()
+    start = time.time()
+    for _ in range(iteration):
+        updater.update()
+    elapsed = time.time() - start
+    return iteration / elapsed
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Training throughput benchmark on synthetic ShapeNet')
+    parser.add_argument('--batchsize', '-b', type=str, default='8,32')
+    parser.add_argument('--num_point', '-n', type=str, default='512,1024')
+    parser.add_argument('--shapes', type=int, default=32,
+                        help='shapes per class and split')
+    parser.add_argument('--iteration', '-i', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--root', type=str, default=None,
+                        help='fixture directory, temporary if not given')
+    parser.add_argument('--output', '-o', type=str, default=None)
+    args = parser.parse_args()
+
+    batch_sizes = [int(v) for v in args.batchsize.split(',')]
+    num_points = [int(v) for v in args.num_point.split(',')]
+    root = args.root or tempfile.mkdtemp(prefix='shapenet_fixture_')
+    if not os.path.exists(os.path.join(root, 'synsetoffset2category.txt')):
+        make_fixture(root, args.shapes)
+
+    results = []
+    try:
+        for num_point in num_points:
+            np.random.seed(0)
+            start = time.time()
+            train = dataset.ChainerPointCloudDatasetDefault(
+                root=root, split='train', num_point=num_point)
+            load_time = time.time() - start
+            for batch_size in batch_sizes:
+                result = {
+                    'num_point': num_point,
+                    'batchsize': batch_size,
+                    'dataset_size': len(train),
+                    'dataset_load_sec': load_time,
+                    'iterator_samples_per_sec': bench_iterator(
+                        train, batch_size, max(len(train) // batch_size, 1)),
+                    'train_iter_per_sec': bench_training(
+                        train, batch_size, num_point, args.iteration,
+                        args.warmup),
+                }
+                result['train_samples_per_sec'] = \
+                    result['train_iter_per_sec'] * batch_size
+                results.append(result)
+                print(json.dumps(result))
+    finally:
+        if args.root is None:
+            shutil.rmtree(root)
+
+    report = {'revision': git_revision(), 'time': time.time(),
+              'chainer': chainer.__version__, 'numpy': np.__version__,
+              'iteration': args.iteration, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print('save results to', args.output)
+
+
+if __name__ == '__main__':
+    main()
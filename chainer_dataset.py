@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+import os
+import os.path
+import atexit
+import json
+import numpy as np
+import chainer
+
+import provider
+import point_io
+import shared_dataset
+from dataset import pc_normalize, read_h5_rows, load_h5_manifest
+
+
+class ChainerPointCloudDataset(chainer.dataset.DatasetMixin):
+    def __init__(self, data, label, augment=False, normalize=True):
+        assert len(data) == len(label)
+        self.augment = augment
+        self.lenght = len(data)
+        self.data = data
+        self.label = label
+
+    def __len__(self):
+        return self.lenght
+
+    def get_example(self, i):
+        if self.augment:
+            rotated_data = provider.rotate_point_cloud(
+                self.data[i][None])
+            jittered_data = provider.jitter_point_cloud(rotated_data)
+            point_data = jittered_data[0]
+        else:
+            point_data = self.data[i]
+        point_data = np.transpose(
+            point_data.astype(np.float32), (1, 0))[:, :, None]
+        return point_data, self.label[i]
+
+    def get_data(self, i):
+        return self.data[i]
+        
+    def get_label(self, i):
+        return self.label[i]
+    
+    def get_data_array(self):
+        return self.data
+
+    def get_label_array(self):
+        return self.label
+
+
+class ChainerPointCloudDatasetDefault(chainer.dataset.DatasetMixin):
+    def __init__(self, root=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data/shapenetcore_partanno_segmentation_benchmark_v0'), 
+    num_point=1024, classification=True, class_choice=None, split='train', normalize=True, augment=False,
+    variable_size=False):
+        self.root = root
+        self.num_point = num_point
+        # keep the points of each file, at most num_point of them, instead
+        # of resampling them to num_point (see concat_packed)
+        self.variable_size = variable_size
+        self.classification = classification
+        self.class_choice = class_choice
+        self.split = split
+        self.normalize = normalize
+        self.augment = augment
+        self.catfile = os.path.join(self.root, 'synsetoffset2category.txt')
+        self.cat = {}
+        self.lenght = 0
+        self.class_name = {}
+        self.class_number = {}
+
+        #allocate data directory divided by classes to self.cat 
+        with open(self.catfile, 'r') as f:
+            for line in f:
+                ls = line.strip().split()
+                self.cat[ls[0]] = ls[1]
+        if self.class_choice is not None:
+            self.cat = {k: v for k, v in self.cat.items() if k in self.class_choice}
+
+        self.meta = {}
+        #allocate files name except extension to XX_ids
+        with open(os.path.join(self.root, 'train_test_split', 'shuffled_train_file_list.json'), 'r') as f:
+            train_ids = set([str(d.split('/')[2]) for d in json.load(f)])
+        with open(os.path.join(self.root, 'train_test_split', 'shuffled_val_file_list.json'), 'r') as f:
+            val_ids = set([str(d.split('/')[2]) for d in json.load(f)])
+        with open(os.path.join(self.root, 'train_test_split', 'shuffled_test_file_list.json'), 'r') as f:
+            test_ids = set([str(d.split('/')[2]) for d in json.load(f)])
+
+        #allocate file length
+        count_label = 0
+        # allocate each class length
+        clasees_length = {}
+        #print(self.cat)
+        #example:{'Car': '02958343', 'Guitar': '03467517'} number is folder mame.
+        for item in self.cat:
+            self.meta[item] = []
+            dir_point = os.path.join(self.root, self.cat[item], 'points')
+            dir_seg = os.path.join(self.root, self.cat[item], 'points_label')
+            #get filename in points folder
+            fns = sorted(os.listdir(dir_point))
+            if self.split == 'trainval':
+                fns = [fn for fn in fns if (
+                    (fn[0:-4] in train_ids) or (fn[0:-4] in val_ids))]
+            elif self.split == 'train':
+                fns = [fn for fn in fns if fn[0:-4] in train_ids]
+            elif self.split == 'val':
+                fns = [fn for fn in fns if fn[0:-4] in val_ids]
+            elif self.split == 'test':
+                fns = [fn for fn in fns if fn[0:-4] in test_ids]
+            else:
+                print('Unknown split: %s. Exiting..' % (self.split))
+                exit(-1)
+
+            for fn in fns:
+                token = (os.path.splitext(os.path.basename(fn))[0])
+                self.meta[item].append(
+                    (os.path.join(dir_point, token + '.pts'), os.path.join(dir_seg, token + '.seg')))
+            #add [class lenght, lebel number]
+            clasees_length[item] = len(self.meta[item])
+            self.lenght += len(self.meta[item])
+            self.class_name[count_label] = item
+            self.class_number[item] = count_label
+            count_label+=1
+
+        #現在は座標のみとなっている。3のこと
+        #self.dataにはすべてのファイルの点群データが読み込まれる。
+        #予定図:[ファイル][点群][座標]
+        if self.variable_size:
+            self.data = [None] * self.lenght
+        else:
+            self.data = np.zeros(shape=(self.lenght,self.num_point,3),dtype=float)
+        #self.labelはlabelデータ
+        if self.classification:
+            self.label = np.zeros(shape=(self.lenght),dtype=int)
+        elif self.variable_size:
+            self.label = [None] * self.lenght
+        else:
+            self.label = np.zeros(shape=(self.lenght,self.num_point),dtype=int)
+        #allocate number to label and data
+        allocation_number = 0
+        for item in self.cat:
+            for n in range(clasees_length[item]):
+                fp = self.meta[item][n]
+                #extract point set from a pts file
+                point_set = point_io.read_pts(fp[0])
+                #nomalize
+                if self.normalize:
+                    point_set = pc_normalize(point_set)
+                #num_point
+                seg = point_io.read_seg(fp[1]) - 1
+                assert len(point_set) == len(seg)
+                if self.variable_size:
+                    # no duplicates, larger files are subsampled
+                    choice = np.random.choice(len(seg), min(len(seg), self.num_point), replace=False)
+                else:
+                    choice = np.random.choice(len(seg), self.num_point, replace=True)
+                # resample
+                point_set = point_set[choice, :]
+                #allocate points
+                self.data[allocation_number] = point_set
+                #allocate label
+                if self.classification:
+                    self.label[allocation_number] = self.class_number[item]
+                else:
+                    self.label[allocation_number] = seg[choice]
+                allocation_number += 1
+        #メモリ対策?
+        del self.meta
+        #variable_check(self)
+
+    def __len__(self):
+        return self.lenght
+
+    def get_example(self, i):
+        if self.augment:
+            rotated_data = provider.rotate_point_cloud(
+                self.data[i][None])
+            jittered_data = provider.jitter_point_cloud(rotated_data)
+            point_data = jittered_data[0]
+        else:
+            point_data = self.data[i]
+        point_data = np.transpose(
+            point_data.astype(np.float32), (1, 0))[:, :, None]
+        return point_data, self.label[i]
+
+    def get_data(self, i):
+        return self.data[i]
+        
+    def get_label(self, i):
+        return self.label[i]
+    
+    def get_data_array(self):
+        return self.data
+
+    def get_label_array(self):
+        return self.label
+
+
+class ChainerPointCloudDatasetH5(ChainerPointCloudDataset):
+    """ChainerPointCloudDataset over a store written by ingest_pcd_to_h5
+
+    update() only reads the rows ingested since the dataset was loaded,
+    according to the store manifest. Create a new iterator afterwards so
+    that the new rows are sampled. Labels are all 0.
+    """
+
+    def __init__(self, h5_name, keys, augment=False):
+        self.h5_name = h5_name
+        self.keys = keys
+        data = read_h5_rows(h5_name, keys)
+        super(ChainerPointCloudDatasetH5, self).__init__(
+            data, np.zeros(len(data), dtype=int), augment=augment)
+
+    def update(self):
+        """Read new rows, return the number of added rows"""
+        count = load_h5_manifest(self.h5_name).get(self.keys, {}).get('count', self.lenght)
+        if count <= self.lenght:
+            return 0
+        added = count - self.lenght
+        self.data = np.concatenate((self.data, read_h5_rows(self.h5_name, self.keys, self.lenght, count)))
+        self.label = np.zeros(len(self.data), dtype=int)
+        self.lenght = len(self.data)
+        return added
+
+
+class ChainerPointCloudDatasetShared(ChainerPointCloudDataset):
+    """ChainerPointCloudDatasetDefault shared through named shared memory
+
+    Takes the arguments of ChainerPointCloudDatasetDefault. The first
+    process parses the files and publishes the arrays, the others attach to
+    them read-only (see shared_dataset.py). The reference of this process is
+    dropped by close() or at exit, and the last one removes the segment.
+
+    Args:
+        shm_dir (str): directory of the segments.
+    """
+
+    def __init__(self, root=shared_dataset.DEFAULT_ROOT, num_point=1024, classification=True,
+                 class_choice=None, split='train', normalize=True, augment=False,
+                 shm_dir=shared_dataset.SHM_DIR):
+        self.path = os.path.join(shm_dir, shared_dataset.segment_name(
+            root, num_point, classification, class_choice, split, normalize))
+        self.published = False
+        with shared_dataset.lock(self.path):
+            if not os.path.isdir(self.path):
+                d = ChainerPointCloudDatasetDefault(
+                    root=root, num_point=num_point, classification=classification,
+                    class_choice=class_choice, split=split, normalize=normalize)
+                shared_dataset.publish(self.path, {'data': d.data, 'label': d.label},
+                                       {'class_name': d.class_name, 'class_number': d.class_number})
+                self.published = True
+                del d
+            arrays, meta = shared_dataset.attach(self.path)
+            shared_dataset.acquire(self.path)
+        self._pid = os.getpid()
+        super(ChainerPointCloudDatasetShared, self).__init__(
+            arrays['data'], arrays['label'], augment=augment, normalize=normalize)
+        # json keys are strings
+        self.class_name = {int(k): v for k, v in meta['class_name'].items()}
+        self.class_number = meta['class_number']
+        atexit.register(self.close)
+
+    def close(self):
+        """Drop the reference, the last process removes the segment"""
+        # forked children share the reference of their parent
+        if self.path is None or self._pid != os.getpid():
+            return
+        path, self.path = self.path, None
+        shared_dataset.release(path)
+
+
+def concat_packed(batch, device=None):
+    """Converter packing clouds of different sizes along the point axis
+
+    Examples are ((3, n_i, 1) cloud, label) tuples with an optional
+    importance weight (see samplers.py), e.g. of a
+    ChainerPointCloudDatasetDefault with ``variable_size=True``. The clouds
+    are concatenated into one (1, 3, sum n_i, 1) array instead of being
+    resampled to a common size (see models/packed.py).
+
+    Returns:
+        dict of the PointNetAE arguments ``x``, ``y`` (labels), ``lengths``
+        ((B,) points of each cloud, kept on the host) and ``weight`` when
+        the examples have one.
+    """
+    to_device = chainer.dataset.to_device
+    x = np.concatenate([example[0] for example in batch], axis=1)[None]
+    lengths = np.array([example[0].shape[1] for example in batch])
+    labels = [example[1] for example in batch]
+    # per point labels are packed like the points
+    y = np.concatenate(labels) if np.ndim(labels[0]) else np.asarray(labels)
+    in_arrays = {'x': to_device(device, x), 'y': to_device(device, y), 'lengths': lengths}
+    if len(batch[0]) > 2:
+        weight = np.asarray([example[2] for example in batch], dtype=np.float32)
+        in_arrays['weight'] = to_device(device, weight)
+    return in_arrays
@@ -0,0 +1,258 @@
+"""
+Point cloud compression with the latent codes of a trained PointNetAE.
+
+Each cloud is stored as its 1024-d encoder output in float16. Clouds whose
+reconstruction Chamfer distance (same scale as dist_loss) is above --bound
+also get a residual: for every input point, the index of its nearest
+decoded point (uint16) and the int8 quantized offset to it with a per
+cloud scale. Everything is written to chunked datasets of an h5 file, and
+any cloud can be decoded on its own.
+
+    python codec.py --mode encode -lf result/model.npz -o result/latent.h5 --bound 0.5
+    python codec.py --mode decode -lf result/model.npz -o result/latent.h5 -i 0,10,20
+"""
+import numpy as np
+import os
+import time
+import argparse
+from distutils.util import strtobool
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LATENT_DTYPE = np.float16
+
+
+def _latent(model, x):
+    import chainer
+    h, _, _ = model.encoder(x)
+    h = chainer.backends.cuda.to_cpu(h.array)
+    return h.reshape(len(h), -1).astype(LATENT_DTYPE)
+
+
+def _decode(model, latent):
+    # latent: (B, D) float16 -> (B, N, 3)
+    import chainer
+    h = model.xp.asarray(latent.astype(np.float32))
+    with chainer.using_config('train', False), chainer.no_backprop_mode():
+        y = model.decoder(h)
+    y = chainer.backends.cuda.to_cpu(y.array)
+    return y.reshape(len(y), model.in_dim, model.output_points).transpose(0, 2, 1)
+
+
+def _nearest(points, base):
+    # index of the nearest base point of each point, (N, 3), (M, 3) -> (N,)
+    d = ((points[:, None, :] - base[None, :, :]) ** 2).sum(axis=2)
+    return d.argmin(axis=1)
+
+
+def _chamfer(a, b):
+    # same scale as calc_chamfer_distance_per_sample
+    d = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)
+    return (d.min(axis=0).mean() + d.min(axis=1).mean()) * 100
+
+
+def encode(model, d, path, bound=None, batch_size=32, device=-1, chunk_size=256):
+    """Write the latent codes (and residuals) of all clouds of d to path
+
+    Args:
+        model (PointNetAE): trained model.
+        d: dataset returning ((3, N, 1) cloud, label) tuples.
+        path (str): output h5 file.
+        bound (float): Chamfer distance above which a residual is stored,
+            None stores no residuals.
+        batch_size (int): number of clouds encoded at once.
+        device (int): GPU id, -1 for CPU.
+        chunk_size (int): number of clouds per h5 chunk.
+
+    Returns:
+        dict with the number of clouds and residuals, the raw and file
+        bytes, the compression ratio, the clouds encoded per second and
+        the per cloud Chamfer distances of the decoded clouds.
+    """
+    import h5py
+    import chainer
+    from chainer.dataset.convert import concat_examples
+
+    num = len(d)
+    num_point = model.output_points
+    chamfer = np.empty(num, dtype=np.float32)
+    residual_row = np.full(num, -1, dtype=np.int64)
+    num_residual = 0
+
+    start = time.time()
+    with h5py.File(path, 'w') as f:
+        f.attrs['num_point'] = num_point
+        f.attrs['bound'] = -1. if bound is None else bound
+        latent_set = None
+        index_set = f.create_dataset('residual_index', (0, num_point), maxshape=(None, num_point),
+                                     chunks=(min(chunk_size, 64), num_point), dtype=np.uint16)
+        offset_set = f.create_dataset('residual_offset', (0, num_point, 3), maxshape=(None, num_point, 3),
+                                      chunks=(min(chunk_size, 64), num_point, 3), dtype=np.int8)
+        scale_set = f.create_dataset('residual_scale', (0,), maxshape=(None,),
+                                     chunks=(1024,), dtype=np.float32)
+        with chainer.using_config('train', False), chainer.no_backprop_mode():
+            for i in range(0, num, batch_size):
+                x, _ = concat_examples([d[j] for j in range(i, min(i + batch_size, num))], device)
+                latent = _latent(model, x)
+                if latent_set is None:
+                    latent_set = f.create_dataset('latent', (num, latent.shape[1]), dtype=LATENT_DTYPE,
+                                                  chunks=(min(chunk_size, num), latent.shape[1]))
+                latent_set[i:i + len(latent)] = latent
+                # decode from the stored float16 codes, as the decoder will
+                base = _decode(model, latent)
+                points = chainer.backends.cuda.to_cpu(x)[:, :, :, 0].transpose(0, 2, 1)
+                for k, (p, b) in enumerate(zip(points, base)):
+                    n = i + k
+                    chamfer[n] = _chamfer(p, b)
+                    if bound is None or chamfer[n] <= bound:
+                        continue
+                    index = _nearest(p, b)
+                    offset = p - b[index]
+                    scale = max(np.abs(offset).max() / 127., 1e-12)
+                    q = np.round(offset / scale).astype(np.int8)
+                    row = num_residual
+                    num_residual += 1
+                    for dset in (index_set, offset_set, scale_set):
+                        dset.resize((num_residual,) + dset.shape[1:])
+                    index_set[row] = index
+                    offset_set[row] = q
+                    scale_set[row] = scale
+                    residual_row[n] = row
+                    chamfer[n] = _chamfer(p, b[index] + q * np.float32(scale))
+        f.create_dataset('residual_row', data=residual_row)
+        f.create_dataset('chamfer', data=chamfer)
+    elapsed = time.time() - start
+
+    raw_bytes = num * num_point * 3 * np.dtype(np.float32).itemsize
+    file_bytes = os.path.getsize(path)
+    return {'clouds': num, 'residuals': num_residual,
+            'raw_bytes': raw_bytes, 'file_bytes': file_bytes,
+            'ratio': raw_bytes / float(file_bytes),
+            'encode_per_sec': num / elapsed, 'chamfer': chamfer}
+
+
+class LatentArchive(object):
+    """Random access reader of a file written by encode
+
+    Args:
+        path (str): h5 file written by encode.
+        model (PointNetAE): the model the file was encoded with.
+    """
+
+    def __init__(self, path, model):
+        import h5py
+        self.h5 = h5py.File(path, 'r')
+        self.model = model
+        if self.h5.attrs['num_point'] != model.output_points:
+            raise ValueError('{} was encoded with {} points, the model outputs {}'.format(
+                path, self.h5.attrs['num_point'], model.output_points))
+        self.residual_row = self.h5['residual_row'][:]
+        self.chamfer = self.h5['chamfer'][:]
+
+    def __len__(self):
+        return len(self.residual_row)
+
+    def __getitem__(self, i):
+        return self.decode([i])[0]
+
+    def decode(self, indices):
+        """ Decode the clouds of indices
+            Return:
+              BxNx3 array
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        # h5py needs increasing indices for fancy reads
+        order = np.argsort(indices)
+        unique, inverse = np.unique(indices[order], return_inverse=True)
+        latent = self.h5['latent'][unique.tolist()]
+        clouds = _decode(self.model, latent)
+        for k, n in enumerate(unique):
+            row = self.residual_row[n]
+            if row < 0:
+                continue
+            index = self.h5['residual_index'][row]
+            offset = self.h5['residual_offset'][row].astype(np.float32)
+            clouds[k] = clouds[k][index] + offset * self.h5['residual_scale'][row]
+        result = np.empty((len(indices),) + clouds.shape[1:], dtype=np.float32)
+        result[order] = clouds[inverse]
+        return result
+
+    def close(self):
+        self.h5.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Latent code compression of point clouds')
+    parser.add_argument('--mode', type=str, default='encode', choices=['encode', 'decode'])
+    parser.add_argument('--dropout_ratio', type=float, default=0)
+    parser.add_argument('--trans', type=strtobool, default='true')
+    parser.add_argument('--use_bn', type=strtobool, default='true')
+    parser.add_argument('--residual', type=strtobool, default='false')
+    parser.add_argument('--load_file', '-lf', type=str, default='result/model.npz')
+    parser.add_argument('--out', '-o', type=str, default='result/latent.h5')
+    parser.add_argument('--class_choice', type=str, default='Chair',
+                        help='class name, comma separated names or all')
+    parser.add_argument('--split', type=str, default='test')
+    parser.add_argument('--num_point', type=int, default=1024)
+    parser.add_argument('--bound', type=float, default=-1,
+                        help='Chamfer distance above which a residual is stored, -1 disables residuals')
+    parser.add_argument('--batchsize', '-b', type=int, default=32)
+    parser.add_argument('--gpu', '-g', type=int, default=-1)
+    parser.add_argument('--indices', '-i', type=str, default='',
+                        help='comma separated clouds to decode, empty decodes 100 random clouds')
+    args = parser.parse_args()
+
+    # chainer is imported after parsing, so that --help and errors are fast
+    import chainer
+    from chainer import serializers
+
+    # self made
+    import models.pointnet_ae as ae
+    import dataset
+
+    model = ae.PointNetAE(out_dim=3, dropout_ratio=args.dropout_ratio, use_bn=args.use_bn,
+                          trans=args.trans, residual=args.residual, output_points=args.num_point)
+    serializers.load_npz(args.load_file, model)
+    if args.gpu >= 0:
+        chainer.backends.cuda.get_device_from_id(args.gpu).use()
+        model.to_gpu()
+
+    if args.mode == 'encode':
+        class_choice = None if args.class_choice == 'all' else args.class_choice.split(',')
+        d = dataset.ChainerPointCloudDatasetDefault(split=args.split, class_choice=class_choice,
+                                                    num_point=args.num_point)
+        bound = None if args.bound < 0 else args.bound
+        stats = encode(model, d, args.out, bound, args.batchsize, args.gpu)
+        chamfer = stats['chamfer']
+        print('{} clouds, {} with residual'.format(stats['clouds'], stats['residuals']))
+        print('{:.1f} MB -> {:.1f} MB, ratio {:.1f}'.format(
+            stats['raw_bytes'] / 2. ** 20, stats['file_bytes'] / 2. ** 20, stats['ratio']))
+        print('encode {:.1f} clouds/sec'.format(stats['encode_per_sec']))
+        print('chamfer mean {:.5f} median {:.5f} max {:.5f}'.format(
+            chamfer.mean(), np.median(chamfer), chamfer.max()))
+        print('per cloud chamfer distances are saved to {}/chamfer'.format(args.out))
+        return
+
+    with LatentArchive(args.out, model) as archive:
+        if args.indices:
+            indices = [int(v) for v in args.indices.split(',')]
+        else:
+            indices = np.random.choice(len(archive), min(100, len(archive)), replace=False)
+        start = time.time()
+        clouds = archive.decode(indices)
+        elapsed = time.time() - start
+        print('decode {} clouds, {:.1f} clouds/sec'.format(len(clouds), len(clouds) / elapsed))
+        for n in indices[:20]:
+            print('{:>8} chamfer {:.5f} residual {}'.format(
+                n, archive.chamfer[n], archive.residual_row[n] >= 0))
+
+
+if __name__ == '__main__':
+    main()
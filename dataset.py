@@ -3,14 +3,15 @@
 import os
 import os.path
 import json
+import hashlib
+import time
 import numpy as np
 import sys
-import chainer
-import provider
-import h5py
 from distutils.util import strtobool
 import argparse
 
+import point_io
+
 
 def download_dataset():
   BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -27,174 +28,15 @@ def download_dataset():
       os.system('rm %s' % (zipfile))
   return DATA_DIR
 
-class ChainerPointCloudDataset(chainer.dataset.DatasetMixin):
-    def __init__(self, data, label, augment=False, normalize=True):
-        assert len(data) == len(label)
-        self.augment = augment
-        self.lenght = len(data)
-        self.data = data
-        self.label = label
-
-    def __len__(self):
-        return self.lenght
-
-    def get_example(self, i):
-        if self.augment:
-            rotated_data = provider.rotate_point_cloud(
-                self.data[i:i + 1, :, :])
-            jittered_data = provider.jitter_point_cloud(rotated_data)
-            point_data = jittered_data[0]
-        else:
-            point_data = self.data[i]
-        point_data = np.transpose(
-            point_data.astype(np.float32), (1, 0))[:, :, None]
-        return point_data, self.label[i]
-
-    def get_data(self, i):
-        return self.data[i]
-        
-    def get_label(self, i):
-        return self.label[i]
-    
-    def get_data_array(self):
-        return self.data
-
-    def get_label_array(self):
-        return self.label
-
-
-class ChainerPointCloudDatasetDefault(chainer.dataset.DatasetMixin):
-    def __init__(self, root=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data/shapenetcore_partanno_segmentation_benchmark_v0'), 
-    num_point=1024, classification=True, class_choice=None, split='train', normalize=True, augment=False):
-        self.root = root
-        self.num_point = num_point
-        self.classification = classification
-        self.class_choice = class_choice
-        self.split = split
-        self.normalize = normalize
-        self.augment = augment
-        self.catfile = os.path.join(self.root, 'synsetoffset2category.txt')
-        self.cat = {}
-        self.lenght = 0
-        self.class_name = {}
-        self.class_number = {}
-
-        #allocate data directory divided by classes to self.cat 
-        with open(self.catfile, 'r') as f:
-            for line in f:
-                ls = line.strip().split()
-                self.cat[ls[0]] = ls[1]
-        if self.class_choice is not None:
-            self.cat = {k: v for k, v in self.cat.items() if k in self.class_choice}
-
-        self.meta = {}
-        #allocate files name except extension to XX_ids
-        with open(os.path.join(self.root, 'train_test_split', 'shuffled_train_file_list.json'), 'r') as f:
-            train_ids = set([str(d.split('/')[2]) for d in json.load(f)])
-        with open(os.path.join(self.root, 'train_test_split', 'shuffled_val_file_list.json'), 'r') as f:
-            val_ids = set([str(d.split('/')[2]) for d in json.load(f)])
-        with open(os.path.join(self.root, 'train_test_split', 'shuffled_test_file_list.json'), 'r') as f:
-            test_ids = set([str(d.split('/')[2]) for d in json.load(f)])
-
-        #allocate file length
-        count_label = 0
-        # allocate each class length
-        clasees_length = {}
-        #print(self.cat)
-        #example:{'Car': '02958343', 'Guitar': '03467517'} number is folder mame.
-        for item in self.cat:
-            self.meta[item] = []
-            dir_point = os.path.join(self.root, self.cat[item], 'points')
-            dir_seg = os.path.join(self.root, self.cat[item], 'points_label')
-            #get filename in points folder
-            fns = sorted(os.listdir(dir_point))
-            if self.split == 'trainval':
-                fns = [fn for fn in fns if (
-                    (fn[0:-4] in train_ids) or (fn[0:-4] in val_ids))]
-            elif self.split == 'train':
-                fns = [fn for fn in fns if fn[0:-4] in train_ids]
-            elif self.split == 'val':
-                fns = [fn for fn in fns if fn[0:-4] in val_ids]
-            elif self.split == 'test':
-                fns = [fn for fn in fns if fn[0:-4] in test_ids]
-            else:
-                print('Unknown split: %s. Exiting..' % (self.split))
-                exit(-1)
-
-            for fn in fns:
-                token = (os.path.splitext(os.path.basename(fn))[0])
-                self.meta[item].append(
-                    (os.path.join(dir_point, token + '.pts'), os.path.join(dir_seg, token + '.seg')))
-            #add [class lenght, lebel number]
-            clasees_length[item] = len(self.meta[item])
-            self.lenght += len(self.meta[item])
-            self.class_name[count_label] = item
-            self.class_number[item] = count_label
-            count_label+=1
-
-        #現在は座標のみとなっている。3のこと
-        #self.dataにはすべてのファイルの点群データが読み込まれる。
-        #予定図:[ファイル][点群][座標]
-        self.data = np.zeros(shape=(self.lenght,self.num_point,3),dtype=float)
-        #self.labelはlabelデータ
-        if self.classification:
-            self.label = np.zeros(shape=(self.lenght),dtype=int)
-        else:
-            self.label = np.zeros(shape=(self.lenght,self.num_point),dtype=int)
-        #allocate number to label and data
-        allocation_number = 0
-        for item in self.cat:
-            for n in range(clasees_length[item]):
-                fp = self.meta[item][n]
-                #extract point set from a pts file
-                point_set = np.loadtxt(fp[0]).astype(np.float32)
-                #nomalize
-                if self.normalize:
-                    point_set = pc_normalize(point_set)
-                #num_point
-                seg = np.loadtxt(fp[1]).astype(np.int64) - 1
-                assert len(point_set) == len(seg)
-                choice = np.random.choice(len(seg), self.num_point, replace=True)
-                # resample
-                point_set = point_set[choice, :]
-                #allocate points
-                self.data[allocation_number] = point_set
-                #allocate label
-                if self.classification:
-                    self.label[allocation_number] = self.class_number[item]
-                else:
-                    self.label[allocation_number] = seg[choice]
-                allocation_number += 1
-        #メモリ対策?
-        del self.meta
-        #variable_check(self)
-
-    def __len__(self):
-        return self.lenght
-
-    def get_example(self, i):
-        if self.augment:
-            rotated_data = provider.rotate_point_cloud(
-                self.data[i:i + 1, :, :])
-            jittered_data = provider.jitter_point_cloud(rotated_data)
-            point_data = jittered_data[0]
-        else:
-            point_data = self.data[i]
-        point_data = np.transpose(
-            point_data.astype(np.float32), (1, 0))[:, :, None]
-        return point_data, self.label[i]
-
-    def get_data(self, i):
-        return self.data[i]
-        
-    def get_label(self, i):
-        return self.label[i]
-    
-    def get_data_array(self):
-        return self.data
-
-    def get_label_array(self):
-        return self.label
+def __getattr__(name):
+    # The chainer datasets live in chainer_dataset.py and are imported on
+    # first access, so that the converter CLI doesn't import chainer.
+    if name in ('ChainerPointCloudDataset', 'ChainerPointCloudDatasetDefault',
+                'ChainerPointCloudDatasetH5', 'ChainerPointCloudDatasetShared',
+                'concat_packed'):
+        import chainer_dataset
+        return getattr(chainer_dataset, name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 
 def pc_normalize(pc):
@@ -221,12 +63,14 @@ def variable_check(self):
     print(len(self.class_name))
 
 def convert_array_to_h5(data,file_name=None,keys=None):
+    import h5py
     with h5py.File(file_name, 'w') as f:
         f.create_dataset(keys, data=data)
         f.flush()
         f.close()
 
 def convert_h5_to_dict(file_name=None):
+    import h5py
     data = {}
     with h5py.File(file_name, 'r') as f:
         for key in f.keys():
@@ -243,32 +87,42 @@ def convert_h5_to_array(file_name=None):
             data_array = np.concatenate((data_array,data[d]),axis=0)
     return data_array
 
+def pattern_file_paths(path, file_name_pattern):
+    """ Yield path/front0back, path/front1back, ... while they exist,
+        where file_name_pattern is "front$back" """
+    name_pattern_front, name_pattern_back = file_name_pattern.split("$")
+    file_number = 0
+    while True:
+        file_path = os.path.join(path, name_pattern_front + str(file_number) + name_pattern_back)
+        if not os.path.isfile(file_path):
+            break
+        yield file_path
+        file_number += 1
+
+def read_point_cloud_file(file_path):
+    try:
+        return point_io.read_point_cloud(file_path)
+    except NotImplementedError:
+        # e.g. binary_compressed PCD
+        import open3d.open3d as open3d
+        return np.asarray(open3d.read_point_cloud(file_path).points)
+
+def resample_point_cloud(pc, num_point, normalize=True):
+    choice = np.random.choice(len(pc), int(num_point), replace=True)
+    pc = pc[choice, :]
+    if normalize:
+        pc = pc_normalize(pc)
+    return pc
+
 def convert_pcd_to_array(path=None,file_name_pattern=None,num_point=None, normalize=True):
-    import open3d.open3d as open3d
+    data = []
+    ana_sum = 0
     if(os.path.isdir(path)):
-        name_pattern_split = file_name_pattern.split("$")
-        if(len(name_pattern_split)==2):
-            name_pattern_front = name_pattern_split[0]
-            name_pattern_back = name_pattern_split[1]
-            file_search_sw = True
-            file_number = 0
-            ana_sum = 0
-            while file_search_sw:
-                file_path = os.path.join(path, name_pattern_front + str(file_number) + name_pattern_back)
-                if(os.path.isfile(file_path)):
-                    pc = np.asarray(open3d.read_point_cloud(file_path).points)
-                    ana_sum += len(pc)
-                    choice = np.random.choice(len(pc), int(num_point), replace=True)
-                    pc = pc[choice, :]
-                    if normalize:
-                        pc = pc_normalize(pc)
-                    if file_number == 0:
-                        data = np.array([pc])
-                    else:
-                        data = np.append(data, np.array([pc]),axis=0)
-                    file_number+=1
-                else:
-                    file_search_sw = False
+        for file_path in pattern_file_paths(path, file_name_pattern):
+            pc = read_point_cloud_file(file_path)
+            ana_sum += len(pc)
+            data.append(resample_point_cloud(pc, num_point, normalize))
+    data = np.array(data)
 
     print("path:{}".format(path))
     print("number_of_points_ave:{} ".format(ana_sum/len(data)))
@@ -278,6 +132,95 @@ def convert_pcd_to_h5(path=None,file_name_pattern=None,num_point=None,keys=None,
     data = convert_pcd_to_array(path,file_name_pattern,num_point,normalize)
     convert_array_to_h5(data, h5_name, keys)
 
+def manifest_path(h5_name):
+    return h5_name + '.manifest.json'
+
+def load_h5_manifest(h5_name):
+    """ Return the manifest of an ingest store, {} if there is none.
+        {key: {"count": rows, "ingests": [{"time", "start", "stop", "skipped"}]}} """
+    fp = manifest_path(h5_name)
+    if not os.path.exists(fp):
+        return {}
+    with open(fp, 'r') as f:
+        return json.load(f)
+
+def cloud_hash(pc):
+    """ Hash of the float32 xyz of a point cloud, the key of the rows of
+        an ingest store """
+    return hashlib.sha1(np.ascontiguousarray(pc, dtype=np.float32).tobytes()).hexdigest()
+
+def append_array_to_h5(data, h5_name, keys, hashes=None):
+    """ Append data (BxNx3) to the resizable dataset keys of h5_name.
+        Rows whose hash (one string per row, cloud_hash of the rows by
+        default) is already stored in keys + '_hash' are skipped, and
+        recorded in the manifest. Return (start, stop) of the new rows. """
+    import h5py
+    data = np.asarray(data, dtype=np.float32)
+    if hashes is None:
+        hashes = [cloud_hash(d) for d in data]
+    hashes = np.array(hashes, dtype='S40')
+    hash_key = keys + '_hash'
+    with h5py.File(h5_name, 'a') as f:
+        if keys not in f:
+            f.create_dataset(keys, shape=(0,) + data.shape[1:], maxshape=(None,) + data.shape[1:],
+                             chunks=(64,) + data.shape[1:], dtype=np.float32)
+            f.create_dataset(hash_key, shape=(0,), maxshape=(None,), chunks=(1024,), dtype='S40')
+        elif hash_key not in f:
+            raise ValueError('{} in {} was not created by an ingest, '
+                             'convert it again with --method ingest'.format(keys, h5_name))
+        dset = f[keys]
+        hset = f[hash_key]
+        known = set(hset[:].tolist())
+        keep = []
+        for i, h in enumerate(hashes):
+            if h not in known:
+                known.add(h)
+                keep.append(i)
+        start = dset.shape[0]
+        stop = start + len(keep)
+        if keep:
+            dset.resize((stop,) + dset.shape[1:])
+            dset[start:stop] = data[keep]
+            hset.resize((stop,))
+            hset[start:stop] = hashes[keep]
+
+    manifest = load_h5_manifest(h5_name)
+    entry = manifest.setdefault(keys, {'count': 0, 'ingests': []})
+    entry['count'] = stop
+    entry['ingests'].append({'time': time.time(), 'start': start, 'stop': stop,
+                             'skipped': len(hashes) - len(keep)})
+    tmp = manifest_path(h5_name) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp, manifest_path(h5_name))
+    return start, stop
+
+def read_h5_rows(h5_name, keys, start=0, stop=None):
+    """ Read rows [start, stop) of keys, e.g. only the rows ingested since
+        the manifest count a dataset was built with. """
+    import h5py
+    with h5py.File(h5_name, 'r') as f:
+        return f[keys][start:stop]
+
+def ingest_pcd_to_h5(path=None,file_name_pattern=None,num_point=None,keys=None, h5_name=None, normalize=None):
+    """ Like convert_pcd_to_h5 but appends to an existing store, and skips
+        point clouds which are already stored. Rows are keyed by the
+        cloud_hash of the points read from the file, before resampling. """
+    hashes = []
+    data = []
+    for file_path in pattern_file_paths(path, file_name_pattern):
+        pc = read_point_cloud_file(file_path)
+        hashes.append(cloud_hash(pc))
+        data.append(resample_point_cloud(pc, num_point, normalize))
+    if not data:
+        print("no point clouds in {}".format(path))
+        return None
+    # duplicates are skipped and counted by append_array_to_h5
+    start, stop = append_array_to_h5(np.array(data), h5_name, keys, hashes)
+    print("ingested {} point clouds into {}:{} (rows {}-{}), {} already stored".format(
+        stop - start, h5_name, keys, start, stop, len(data) - (stop - start)))
+    return start, stop
+
 def main():
     parser = argparse.ArgumentParser(description='converter')
     parser.add_argument('--path', '-p', type=str, default=None)
@@ -304,6 +247,8 @@ def main():
     else:
         if method == 'pcd':
             convert_pcd_to_h5(path,file_name_pattern,num_point,keys,h5_name,normalize)
+        elif method == 'ingest':
+            ingest_pcd_to_h5(path,file_name_pattern,num_point,keys,h5_name,normalize)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
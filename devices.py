@@ -0,0 +1,71 @@
+"""
+Device setup shared by the entry points.
+
+``--gpu`` moves the model to a CUDA device. On CPU, ``--device intel64``
+moves the parameters to iDeep (MKL-DNN) arrays with ``to_intel64()`` and
+enables the ``use_ideep`` config, so convolution, linear, batch
+normalization and pooling of PointNetAE and its TransformNets run on
+iDeep. The other functions, including the Chamfer distance, keep working
+on NumPy arrays. When iDeep isn't installed, NumPy is used with a warning.
+"""
+import warnings
+
+import chainer
+from chainer import backends
+
+
+CPU_DEVICES = ['numpy', 'intel64']
+
+
+def intel64_available():
+    return backends.intel64.is_ideep_available()
+
+
+def setup_device(model, gpu=-1, device='numpy'):
+    """Move model to the GPU or to iDeep
+
+    Args:
+        model (chainer.Link): model to move.
+        gpu (int): GPU id, -1 for CPU.
+        device (str): CPU backend, ``numpy`` or ``intel64``.
+
+    Returns:
+        name of the backend in use, ``cupy``, ``intel64`` or ``numpy``.
+    """
+    if gpu >= 0:
+        backends.cuda.get_device_from_id(gpu).use()
+        model.to_gpu()
+        return 'cupy'
+    if device == 'intel64':
+        if intel64_available():
+            model.to_intel64()
+            chainer.global_config.use_ideep = 'auto'
+            return 'intel64'
+        warnings.warn('iDeep is not installed (pip install ideep4py), '
+                      'falling back to numpy')
+    elif device != 'numpy':
+        raise ValueError('unknown device {}, choose from {}'.format(device, CPU_DEVICES))
+    return 'numpy'
+
+
+def updater_device(gpu, backend):
+    """Device argument of the updaters and evaluators for backend
+
+    Chainer updaters move the target link to their device, and -1 would
+    convert the iDeep parameters back to NumPy, so None is used to leave
+    the model where setup_device put it.
+    """
+    return None if backend == 'intel64' else gpu
+
+
+def check_backend(model, backend):
+    """Raise RuntimeError if the parameters of model left iDeep"""
+    if backend != 'intel64':
+        return
+    for name, param in model.namedparams():
+        array = param.array
+        # to_intel64 only converts the arrays iDeep supports
+        if array is not None and backends.intel64.inputs_all_ready((array,)) \
+                and not isinstance(array, backends.intel64.mdarray):
+            raise RuntimeError('{} is a {}, not an iDeep array'.format(
+                name, type(array).__name__))
@@ -0,0 +1,434 @@
+import json
+import os
+import re
+import tempfile
+import threading
+
+import numpy as np
+
+import chainer
+from chainer import iterators
+from chainer import reporter as reporter_module
+from chainer import serializers
+from chainer import training
+from chainer.dataset.convert import concat_examples
+from chainer.training import extensions as E
+
+
+SNAPSHOT_PATTERN = re.compile(r'^snapshot_iter_(\d+)$')
+
+
+def _rng_state():
+    _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return {'rng/keys': keys, 'rng/pos': np.asarray(pos),
+            'rng/has_gauss': np.asarray(has_gauss),
+            'rng/cached_gaussian': np.asarray(cached_gaussian)}
+
+
+def _hyperparams(trainer):
+    # Optimizer.serialize doesn't save hyperparameters such as Adam's alpha
+    values = {}
+    for name, optimizer in trainer.updater.get_all_optimizers().items():
+        for key, value in optimizer.hyperparam.get_dict().items():
+            if isinstance(value, (bool, int, float)):
+                values['hyperparam/{}/{}'.format(name, key)] = np.asarray(value)
+    return values
+
+
+def _set_hyperparams(trainer, f):
+    optimizers = trainer.updater.get_all_optimizers()
+    for key in f.files:
+        if key.startswith('hyperparam/'):
+            _, name, attr = key.split('/')
+            if name in optimizers:
+                setattr(optimizers[name].hyperparam, attr, f[key].item())
+
+
+def interval_or_last_trigger(interval, last_epoch, stopped=None):
+    """Trigger firing every ``interval`` epochs and at ``last_epoch``
+
+    ``stopped`` is an optional callable returning True once training stops
+    before ``last_epoch``, e.g. ``lambda: plateau.stopped`` for
+    PlateauEarlyStopping. It is checked at the end of each epoch, so the
+    extension has to run after the one deciding to stop (lower priority).
+    """
+    def trigger(trainer):
+        updater = trainer.updater
+        return updater.is_new_epoch and (
+            updater.epoch % interval == 0 or updater.epoch == last_epoch
+            or (stopped is not None and stopped()))
+    return trigger
+
+
+def find_snapshots(out):
+    """Return snapshot paths in ``out`` sorted by iteration (oldest first)"""
+    if not os.path.isdir(out):
+        return []
+    found = []
+    for fn in os.listdir(out):
+        m = SNAPSHOT_PATTERN.match(fn)
+        if m:
+            found.append((int(m.group(1)), os.path.join(out, fn)))
+    return [path for _, path in sorted(found)]
+
+
+def latest_snapshot(out):
+    snapshots = find_snapshots(out)
+    return snapshots[-1] if snapshots else ''
+
+
+def load_snapshot(path, trainer):
+    """Resume ``trainer`` from a snapshot written by AsyncSnapshot
+
+    Restores the trainer, updater (optimizer state, hyperparameters such
+    as the learning rate, and iterator position), extensions and the
+    global NumPy random state.
+    """
+    serializers.load_npz(path, trainer)
+    with np.load(path) as f:
+        _set_hyperparams(trainer, f)
+        if 'rng/keys' in f:
+            np.random.set_state(('MT19937', f['rng/keys'], int(f['rng/pos']),
+                                 int(f['rng/has_gauss']),
+                                 float(f['rng/cached_gaussian'])))
+
+
+class AsyncSnapshot(training.Extension):
+    """Take trainer snapshots on a background thread
+
+    The trainer state is serialized into a copied dictionary in the main
+    loop, then written by a background thread so that training doesn't
+    stall on disk I/O. The file is written to a temporary file and renamed,
+    so a crash never leaves a truncated snapshot behind. Only the newest
+    ``keep`` snapshots in the output directory are kept.
+
+    Args:
+        keep (int): number of snapshots to keep, 0 or less keeps all of
+            them.
+    """
+
+    priority = -100
+
+    def __init__(self, keep=3):
+        self.keep = keep
+        self._thread = None
+        self._error = None
+
+    def __call__(self, trainer):
+        serializer = serializers.DictionarySerializer()
+        serializer.save(trainer)
+        target = {key: np.array(value, copy=True)
+                  for key, value in serializer.target.items()}
+        target.update(_rng_state())
+        target.update(_hyperparams(trainer))
+
+        self._wait()
+        filename = 'snapshot_iter_{}'.format(trainer.updater.iteration)
+        self._thread = threading.Thread(
+            target=self._write, args=(trainer.out, filename, target))
+        self._thread.start()
+
+    def _write(self, out, filename, target):
+        try:
+            fd, tmppath = tempfile.mkstemp(prefix='.tmp' + filename, dir=out)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(f, **target)
+                os.replace(tmppath, os.path.join(out, filename))
+            except Exception:
+                os.remove(tmppath)
+                raise
+            if self.keep > 0:
+                for path in find_snapshots(out)[:-self.keep]:
+                    os.remove(path)
+        except Exception as e:
+            self._error = e
+
+    def _wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def finalize(self):
+        self._wait()
+
+
+class CachedEvaluator(E.Evaluator):
+    """Evaluator keeping the converted validation batches in memory
+
+    The dataset is converted once, on the first evaluation, into device
+    ready batches which are reused afterwards, so each evaluation only
+    runs the forward pass. If ``subsample`` is given, intermediate
+    evaluations only use a fixed random subset of about ``subsample``
+    examples, and the whole set is evaluated every ``full_interval``
+    epochs and at the end of training. Subset evaluations are reported
+    under ``<name>_subset``, e.g. ``validation_subset/main/dist_loss``.
+
+    Args:
+        dataset: validation dataset.
+        target (chainer.Link): link to evaluate.
+        batch_size (int): number of examples per cached batch.
+        converter: converter function.
+        device (int): device the batches are sent to.
+        subsample (int): number of examples of intermediate evaluations,
+            0 or less always evaluates the whole set.
+        full_interval (int): interval in epochs of full evaluations.
+        seed (int): seed of the subset selection.
+    """
+
+    def __init__(self, dataset, target, batch_size, converter=concat_examples,
+                 device=None, subsample=0, full_interval=1, seed=0):
+        iterator = iterators.SerialIterator(
+            dataset, batch_size, repeat=False, shuffle=False)
+        super(CachedEvaluator, self).__init__(
+            iterator, target, converter=converter, device=device)
+        self._dataset = dataset
+        self._batch_size = batch_size
+        self._subsample = subsample
+        self._full_interval = full_interval
+        self._seed = seed
+        self._batches = None
+        self._n_subsample_batches = None
+        self._full = True
+
+    def _build_cache(self):
+        # a fixed permutation, so the first batches form the random subset
+        order = np.random.RandomState(self._seed).permutation(len(self._dataset))
+        self._batches = []
+        for i in range(0, len(order), self._batch_size):
+            batch = [self._dataset[j] for j in order[i:i + self._batch_size]]
+            self._batches.append(self.converter(batch, self.device))
+        if self._subsample > 0:
+            self._n_subsample_batches = max(
+                1, -(-self._subsample // self._batch_size))
+        else:
+            self._n_subsample_batches = len(self._batches)
+
+    def __call__(self, trainer=None):
+        self._full = True
+        if trainer is not None and self._subsample > 0:
+            epoch = trainer.updater.epoch
+            length = getattr(trainer.stop_trigger, 'get_training_length', None)
+            last = length is not None and length() == (epoch, 'epoch')
+            self._full = last or epoch % self._full_interval == 0
+        name = self.name
+        if not self._full and name is not None:
+            # subset losses are noisier, they don't mix with the full ones
+            self.name = name + '_subset'
+        try:
+            return super(CachedEvaluator, self).__call__(trainer)
+        finally:
+            self.name = name
+
+    def evaluate(self):
+        if self._batches is None:
+            self._build_cache()
+        eval_func = self.eval_func or self._targets['main']
+        if self.eval_hook:
+            self.eval_hook(self)
+
+        batches = self._batches
+        if not self._full:
+            batches = batches[:self._n_subsample_batches]
+        summary = reporter_module.DictSummary()
+        for in_arrays in batches:
+            observation = {}
+            with reporter_module.report_scope(observation):
+                with chainer.no_backprop_mode():
+                    if isinstance(in_arrays, tuple):
+                        eval_func(*in_arrays)
+                    elif isinstance(in_arrays, dict):
+                        eval_func(**in_arrays)
+                    else:
+                        eval_func(in_arrays)
+            summary.add(observation)
+        return summary.compute_mean()
+
+
+class _EarlyStoppingTrigger(object):
+
+    def __init__(self, extension, max_epoch):
+        self.extension = extension
+        self._interval = training.triggers.IntervalTrigger(max_epoch, 'epoch')
+
+    def __call__(self, trainer):
+        return self.extension.stopped or self._interval(trainer)
+
+    def get_training_length(self):
+        return self._interval.get_training_length()
+
+    def serialize(self, serializer):
+        if hasattr(self._interval, 'serialize'):
+            self._interval.serialize(serializer)
+
+
+class PlateauEarlyStopping(training.Extension):
+    """Drop the learning rate on plateaus and stop when training converged
+
+    Watches ``monitor`` at the end of every epoch it is reported, i.e.
+    after each evaluation. When it hasn't improved by a relative
+    ``threshold`` for ``patience`` evaluations, the learning rate
+    ``lr_attr`` of the optimizer is multiplied by ``factor`` (down to
+    ``min_lr``). After ``stop_patience`` evaluations without improvement the
+    training is stopped through the trigger returned by ``stop_trigger()``,
+    which has to be given to the Trainer. The best model is saved to
+    ``best_filename`` and the epochs and wall time saved compared to
+    ``max_epoch`` are written to ``early_stopping.json``.
+
+    Args:
+        max_epoch (int): maximum number of epochs.
+        monitor (str): observation key to watch, lower is better.
+        patience (int): evaluations without improvement before a lr drop.
+        factor (float): lr multiplier on a plateau.
+        min_lr (float): lower bound of the lr.
+        threshold (float): minimum relative improvement.
+        stop_patience (int): evaluations without improvement before
+            stopping.
+        lr_attr (str): name of the optimizer hyperparameter to change.
+        best_filename (str): file name of the best model in ``trainer.out``.
+    """
+
+    trigger = 1, 'epoch'
+    priority = training.PRIORITY_READER
+
+    def __init__(self, max_epoch, monitor='validation/main/dist_loss',
+                 patience=10, factor=0.3, min_lr=1e-5, threshold=1e-3,
+                 stop_patience=30, lr_attr='alpha',
+                 best_filename='best_model.npz'):
+        self.max_epoch = max_epoch
+        self.monitor = monitor
+        self.patience = patience
+        self.factor = factor
+        self.min_lr = min_lr
+        self.threshold = threshold
+        self.stop_patience = stop_patience
+        self.lr_attr = lr_attr
+        self.best_filename = best_filename
+
+        self.stopped = False
+        self.best = None
+        self._wait = 0
+        self._stale = 0
+        self._out = None
+        self._epoch = 0
+        self._elapsed_time = 0.
+        # learning rate after the drops, restored by serialize
+        self._lr = None
+
+    def stop_trigger(self):
+        return _EarlyStoppingTrigger(self, self.max_epoch)
+
+    def initialize(self, trainer):
+        if self._lr is not None:
+            optimizer = trainer.updater.get_optimizer('main')
+            setattr(optimizer, self.lr_attr, self._lr)
+
+    def __call__(self, trainer):
+        self._out = trainer.out
+        self._lr = getattr(trainer.updater.get_optimizer('main'), self.lr_attr)
+        self._epoch = trainer.updater.epoch
+        self._elapsed_time = trainer.elapsed_time
+        if self.monitor not in trainer.observation:
+            return
+        value = trainer.observation[self.monitor]
+        if isinstance(value, chainer.Variable):
+            value = value.array
+        value = float(chainer.backends.cuda.to_cpu(value))
+
+        if self.best is None or value < self.best * (1 - self.threshold):
+            self.best = value
+            self._wait = 0
+            self._stale = 0
+            optimizer = trainer.updater.get_optimizer('main')
+            serializers.save_npz(
+                os.path.join(trainer.out, self.best_filename), optimizer.target)
+            return
+
+        self._wait += 1
+        self._stale += 1
+        if self._stale >= self.stop_patience:
+            print('early stopping at epoch {}, best {}={}'.format(
+                self._epoch, self.monitor, self.best))
+            self.stopped = True
+        elif self._wait >= self.patience:
+            optimizer = trainer.updater.get_optimizer('main')
+            lr = max(getattr(optimizer, self.lr_attr) * self.factor,
+                     self.min_lr)
+            setattr(optimizer, self.lr_attr, lr)
+            self._lr = lr
+            self._wait = 0
+
+    def finalize(self):
+        if self._out is None or self._epoch == 0:
+            return
+        epochs_saved = max(self.max_epoch - self._epoch, 0)
+        time_saved = self._elapsed_time / self._epoch * epochs_saved
+        result = {'stopped': self.stopped, 'epoch': self._epoch,
+                  'best': self.best, 'epochs_saved': epochs_saved,
+                  'estimated_time_saved': time_saved}
+        with open(os.path.join(self._out, 'early_stopping.json'), 'w') as f:
+            json.dump(result, f, indent=4)
+        if self.stopped:
+            print('saved {} epochs (about {:.1f} sec)'.format(
+                epochs_saved, time_saved))
+
+    def serialize(self, serializer):
+        self.stopped = bool(serializer('stopped', self.stopped))
+        best = serializer('best', np.inf if self.best is None else self.best)
+        self.best = None if np.isinf(best) else float(best)
+        self._wait = int(serializer('_wait', self._wait))
+        self._stale = int(serializer('_stale', self._stale))
+        lr = serializer('lr', -1. if self._lr is None else self._lr)
+        self._lr = None if lr < 0 else float(lr)
+
+
+def curriculum_points(epoch_detail, start, end, epochs, step=64):
+    """Point count of a linear ramp from ``start`` to ``end`` over ``epochs``,
+    rounded down to a multiple of ``step``"""
+    if epochs <= 0 or epoch_detail >= epochs:
+        return end
+    points = start + (end - start) * epoch_detail / epochs
+    return int(min(max(points // step * step, start), end))
+
+
+class PointCurriculum(training.Extension):
+    """Progressive point count curriculum
+
+    Sets ``train_points`` of the model every iteration, so that the encoder
+    input, the decoder output and the Chamfer distance of the training
+    batches use ``start`` points at first and ramp up linearly to ``end``
+    points at ``epochs``. The validation always uses all the points.
+
+    Args:
+        model (PointNetAE): model to train.
+        start (int): number of points at epoch 0.
+        end (int): number of points at the end of the ramp.
+        epochs (int): length of the ramp in epochs.
+        step (int): the point count is a multiple of step.
+    """
+
+    trigger = 1, 'iteration'
+    priority = training.PRIORITY_WRITER
+
+    def __init__(self, model, start, end, epochs, step=64):
+        self.model = model
+        self.start = start
+        self.end = end
+        self.epochs = epochs
+        self.step = step
+
+    def initialize(self, trainer):
+        self._set(trainer.updater.epoch_detail)
+
+    def __call__(self, trainer):
+        points = self._set(trainer.updater.epoch_detail)
+        reporter_module.report({'train_points': points})
+
+    def _set(self, epoch_detail):
+        points = curriculum_points(
+            epoch_detail, self.start, self.end, self.epochs, self.step)
+        self.model.train_points = None if points >= self.end else points
+        return points
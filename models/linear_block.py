@@ -20,7 +20,7 @@ class LinearBlock(chainer.Chain):
         self.dropout_ratio = dropout_ratio
         self.residual = residual
 
-    def __call__(self, x):
+    def forward(self, x):
         if self.use_bn:
             h = self.bn(self.linear(x))
         else:
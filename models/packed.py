@@ -0,0 +1,32 @@
+"""
+Helpers of packed batches, where the clouds of a batch are concatenated
+along the point axis into a (1, K, T, 1) array, T being the total number
+of points, and ``lengths`` (B,) holds the number of points of each cloud.
+The per point convolutions run over the packed array as is, only the
+pooling and the transforms need the cloud boundaries.
+"""
+import numpy as np
+
+from chainer import functions
+
+
+def split_segments(x, lengths):
+    """ x: 1xKxTx1, return: list of 1xKxn_ix1, one per cloud """
+    if len(lengths) == 1:
+        return [x]
+    return functions.split_axis(x, np.cumsum(lengths)[:-1], axis=2)
+
+
+def segment_max_pooling(x, lengths):
+    """ x: 1xKxTx1, return: BxKx1x1, max over the points of each cloud """
+    h = [functions.max(s, axis=2, keepdims=True) for s in split_segments(x, lengths)]
+    return functions.concat(h, axis=0)
+
+
+def segment_transform(t, x, lengths):
+    """ t: BxKxK transform of each cloud,
+        x: 1xKxTx1,
+        return: 1xKxTx1, the points of cloud i multiplied by t[i] """
+    ts = functions.split_axis(t, len(lengths), axis=0)
+    h = [functions.matmul(ti, s[:, :, :, 0]) for ti, s in zip(ts, split_segments(x, lengths))]
+    return functions.expand_dims(functions.concat(h, axis=2), 3)
@@ -4,13 +4,19 @@ from chainer import backends
 from chainer import links
 from chainer import reporter
 import numpy as np
+import time
 
 from .conv_block import ConvBlock
 from .linear_block import LinearBlock
 from .transform_net import TransformNet
+from .packed import split_segments
+from .packed import segment_max_pooling
 
 import models.distance_loss as dl
 
+# chamfer distance above which a cloud is judged as an anomaly
+ANOMALY_THRESHOLD = 0.35
+
 def calc_trans_loss(t):
     # Loss to enforce the transformation as orthogonal matrix
     # t (batchsize, K, K) - transform matrix
@@ -23,13 +29,65 @@ def calc_trans_loss(t):
     # https://www.tensorflow.org/versions/r1.1/api_docs/python/tf/nn/l2_loss
     return functions.sum(functions.batch_l2_norm_squared(mat_diff)) / 2.
 
-def calc_chamfer_distance_loss(pred, label):
+def subsample_points(pc, num_points):
+    """ pc: BxCxNx1,
+        return: BxCxnum_pointsx1, a fresh random subset per sample """
+    xp = backends.cuda.get_array_module(pc)
+    bs, c, n, _ = pc.shape
+    index = np.argsort(np.random.rand(bs, n), axis=1)[:, :num_points]
+    index = xp.asarray(index + np.arange(bs)[:, None] * n).ravel()
+    # gather (B*N, C) rows, so one index array covers the whole batch
+    h = functions.reshape(functions.transpose(pc, (0, 2, 1, 3)), (bs * n, c))
+    h = functions.get_item(h, index)
+    h = functions.reshape(h, (bs, num_points, c))
+    return functions.expand_dims(functions.transpose(h, (0, 2, 1)), 3)
+
+def _chamfer_inputs(pred, label, sample_points):
+    # stochastic estimate on random subsets of both clouds
+    if sample_points is None:
+        return pred, label
+    if sample_points < pred.shape[2]:
+        pred = subsample_points(pred, sample_points)
+    if sample_points < label.shape[2]:
+        label = subsample_points(label, sample_points)
+    return pred, label
+
+def calc_chamfer_distance_loss(pred, label, sample_points=None):
     """ pred: BxNx3,
-        label: BxNx3, """
+        label: BxNx3,
+        sample_points: None for the exact distance, otherwise the number
+          of random points of each cloud the distance is estimated with """
+    pred, label = _chamfer_inputs(pred, label, sample_points)
     dists_forward,_,dists_backward,_ = dl.chamfer_distance(pred,label)
     loss = functions.mean(dists_forward+dists_backward)
     return loss*100
 
+def calc_chamfer_distance_per_sample(pred, label, sample_points=None):
+    """ pred: BxNx3,
+        label: BxNx3,
+        sample_points: see calc_chamfer_distance_loss
+        return: B, same scale as calc_chamfer_distance_loss """
+    pred, label = _chamfer_inputs(pred, label, sample_points)
+    dists_forward,_,dists_backward,_ = dl.chamfer_distance(pred,label)
+    dists = dists_forward+dists_backward
+    dists = functions.reshape(dists, (dists.shape[0], -1))
+    return functions.mean(dists, axis=1)*100
+
+def calc_chamfer_distance_packed(pred, label, lengths, sample_points=None):
+    """ pred: BxCxMx1, decoded clouds,
+        label: 1xCxTx1, packed batch of the B input clouds (see packed.py),
+        lengths: B, number of points of each input cloud,
+        sample_points: see calc_chamfer_distance_loss
+        return: B, same scale as calc_chamfer_distance_per_sample """
+    dists = []
+    for p, l in zip(functions.split_axis(pred, len(lengths), axis=0),
+                    split_segments(label, lengths)):
+        p, l = _chamfer_inputs(p, l, sample_points)
+        dists_forward,_,dists_backward,_ = dl.chamfer_distance(p,l)
+        # the clouds have different sizes, so each direction is averaged
+        dists.append(functions.mean(dists_forward)+functions.mean(dists_backward))
+    return functions.stack(dists)*100
+
 
 class PointNetAE(chainer.Chain):
 
@@ -68,19 +126,48 @@ class PointNetAE(chainer.Chain):
         self.trans_lam1 = trans_lam1
         self.trans_lam2 = trans_lam2
         self.output_points = output_points
+        # dict to accumulate per phase seconds into, None disables timing
+        self.phase_times = None
+        # per sample chamfer distances of the last training batch
+        self.sample_losses = None
+        # number of points used in training, None uses all of them
+        self.train_points = None
+        # points per cloud of the stochastic training chamfer, None is exact
+        self.chamfer_points = None
 
-    def __call__(self, x, y):
+    def forward(self, x, y, weight=None, lengths=None):
+        # weight: (bs,) importance weights of the samples, see samplers.py
+        # lengths: (bs,) points of each cloud of a packed x, see packed.py
         #print(x.shape)
         #print(x[0][0][0][0])
+        out_index = None
+        if lengths is None:
+            x, out_index = self._subsample_points(x)
         t = x
-        h, t1, t2 = self.calc(x)
+        h, t1, t2 = self.calc(x, lengths)
+        if out_index is not None:
+            # compare the same number of output points with the input
+            h = h[:, :, out_index]
         #The h 4th dim is needed dist_loss.
         # h: (bs, ch, N, 1), t: (bs, N)
         # print('h', h.shape, 't', t.shape)
-        dist_loss = calc_chamfer_distance_loss(h,t)
+        start = self._record_phase(None, None)
+        # the validation always uses the exact distance
+        sample_points = self.chamfer_points if chainer.config.train else None
+        if lengths is None:
+            sample_loss = calc_chamfer_distance_per_sample(h,t,sample_points)
+        else:
+            sample_loss = calc_chamfer_distance_packed(h,t,lengths,sample_points)
+        dist_loss = functions.mean(sample_loss)
+        self._record_phase('loss', start)
         reporter.report({'dist_loss': dist_loss}, self)
+        if chainer.config.train:
+            self.sample_losses = sample_loss.array
 
-        loss = dist_loss
+        if weight is not None:
+            loss = functions.mean(sample_loss * weight)
+        else:
+            loss = dist_loss
 
         # Enforce the transformation as orthogonal matrix
         if self.trans and self.trans_lam1 >= 0:
@@ -95,17 +182,32 @@ class PointNetAE(chainer.Chain):
 
         return loss
 
-    def encoder(self, x):
+    def _subsample_points(self, x):
+        # random train_points of the input and of the decoder output slots
+        n = x.shape[2]
+        if not chainer.config.train or self.train_points is None \
+                or self.train_points >= n:
+            return x, None
+        xp = self.xp
+        in_index = xp.asarray(np.random.choice(n, self.train_points, replace=False))
+        out_index = xp.asarray(np.random.choice(
+            self.output_points, self.train_points, replace=False))
+        if isinstance(x, chainer.Variable):
+            x = x.array
+        return x[:, :, in_index], out_index
+
+    def encoder(self, x, lengths=None):
         #print("x:{}".format(x))
         # x: (minibatch, K, N, 1)
         # N - num_point
         # K - feature degree (this is 3 for xyz input, 64 for middle layer)
+        # with lengths, x is a packed batch (1, K, T, 1) of len(lengths) clouds
         assert x.ndim == 4
         assert x.shape[-1] == 1
 
         # --- input transform ---
         if self.trans:
-            h, t1 = self.input_transform_net(x)
+            h, t1 = self.input_transform_net(x, lengths)
         else:
             h = x
             t1 = 0  # dummy
@@ -115,7 +217,7 @@ class PointNetAE(chainer.Chain):
 
         # --- feature transform ---
         if self.trans:
-            h, t2 = self.feature_transform_net(h)
+            h, t2 = self.feature_transform_net(h, lengths)
         else:
             t2 = 0  # dummy
 
@@ -126,7 +228,10 @@ class PointNetAE(chainer.Chain):
         # Symmetric function: max pooling
         bs, k, n, tmp = h.shape
         assert tmp == 1
-        h = functions.max_pooling_2d(h, ksize=h.shape[2:])
+        if lengths is None:
+            h = functions.max_pooling_2d(h, ksize=h.shape[2:])
+        else:
+            h = segment_max_pooling(h, lengths)
         # h: (minibatch, K, 1, 1)
 
         return h, t1, t2
@@ -139,18 +244,37 @@ class PointNetAE(chainer.Chain):
         return h
 
 
-    def calc(self, x):
-        h, t1, t2 = self.encoder(x)
+    def calc(self, x, lengths=None):
+        start = self._record_phase(None, None)
+        h, t1, t2 = self.encoder(x, lengths)
+        start = self._record_phase('encoder', start)
         h = self.decoder(h)
-        h = functions.reshape(h, (x.shape[0],self.in_dim,self.output_points,1))
+        h = functions.reshape(h, (h.shape[0],self.in_dim,self.output_points,1))
+        self._record_phase('decoder', start)
         return h, t1, t2
 
+    def _record_phase(self, name, start):
+        # add the time since start to phase_times[name] and return now
+        if self.phase_times is None:
+            return None
+        if self.xp is not np:
+            backends.cuda.Stream.null.synchronize()
+        now = time.time()
+        if name is not None:
+            self.phase_times[name] = self.phase_times.get(name, 0.) + now - start
+        return now
+
     def anomaly_score(self, x):
         t = x
         h,_,_ = self.calc(x)
         ano_score = calc_chamfer_distance_loss(h,t).array
-        if ano_score <= 0.35:
+        if ano_score <= ANOMALY_THRESHOLD:
             res = 1
         else:
             res = -1
         return res
+
+    def anomaly_scores(self, x):
+        # per sample version of anomaly_score, returns chamfer distances (B,)
+        h,_,_ = self.calc(x)
+        return calc_chamfer_distance_per_sample(h,x).array
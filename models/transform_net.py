@@ -6,6 +6,8 @@ from chainer import initializers
 from chainer import links
 
 from .conv_block import ConvBlock
+from .packed import segment_max_pooling
+from .packed import segment_transform
 
 
 class TransformModule(chainer.Chain):
@@ -14,6 +16,7 @@ class TransformModule(chainer.Chain):
 
     This class produces transform matrix
     Input is (minibatch, K, N, 1), output is (minibatch, K, K)
+    With lengths, input is a packed batch (1, K, T, 1), see packed.py
 
     Args:
         k (int): hidden layer's coordinate dimension
@@ -46,7 +49,7 @@ class TransformModule(chainer.Chain):
                 initial_bias=initial_bias)
         self.k = k
 
-    def __call__(self, x):
+    def forward(self, x, lengths=None):
         # reference --> x: (minibatch, N, 1, K) <- original tf impl.
         # x: (minibatch, K, N, 1) <- chainer impl.
         # N - num_point
@@ -54,7 +57,10 @@ class TransformModule(chainer.Chain):
         h = self.conv_block1(x)
         h = self.conv_block2(h)
         h = self.conv_block3(h)
-        h = functions.max_pooling_2d(h, ksize=h.shape[2:])
+        if lengths is None:
+            h = functions.max_pooling_2d(h, ksize=h.shape[2:])
+        else:
+            h = segment_max_pooling(h, lengths)
         # h: (minibatch, K, 1, 1)
         h = functions.relu(self.fc4(h))
         h = functions.relu(self.fc5(h))
@@ -71,6 +77,7 @@ class TransformNet(chainer.Chain):
     This class can be used for Both InputTransformNet & FeatureTransformNet
     Input is (minibatch, K, N, 1),
     output is (minibatch, K, N, 1), which is transformed
+    With lengths, input and output are packed batches, see packed.py
 
     Args:
         k (int): hidden layer's coordinate dimension
@@ -84,8 +91,10 @@ class TransformNet(chainer.Chain):
             self.trans_module = TransformModule(
                 k=k, use_bn=use_bn, residual=residual)
 
-    def __call__(self, x):
-        t = self.trans_module(x)
+    def forward(self, x, lengths=None):
+        t = self.trans_module(x, lengths)
+        if lengths is not None:
+            return segment_transform(t, x, lengths), t
         # t: (minibatch, K, K)
         # x: (minibatch, K, N, 1)
         # h: (minibatch, K, N)
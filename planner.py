@@ -0,0 +1,248 @@
+"""
+Batch size planner for a memory budget.
+
+The peak memory of a training iteration is estimated from the model
+configuration: the gradients and Adam states of the parameters, the
+activations every convolution and linear layer keeps for the backward, and
+the tiled (B, 3, N, M, 1) tensors of the Chamfer distance with their
+gradients. The parameters themselves are already allocated and not
+counted. The largest batch size whose estimate fits the budget is then
+validated with a probe iteration, in a forked process on CPU so that
+running out of memory doesn't kill the caller, and moved down until the
+measured peak fits, or up while it is well under the budget.
+
+    python planner.py -n 2048 --memory_budget 8000
+"""
+import os
+import time
+import argparse
+import multiprocessing
+import resource
+
+import numpy as np
+
+FLOAT_BYTES = 4
+# arrays batch normalization and the activation keep for the backward
+ARRAYS_PER_LAYER = 2
+# difference of the tiled clouds kept for the backward, and the gradients
+# of the square, the difference and both tiles
+CHAMFER_ARRAYS = 4
+# probes under this fraction of the budget try a larger batch size
+GROW_MARGIN = 0.85
+
+
+def _mb(n):
+    return n / 2. ** 20
+
+
+def available_memory(gpu=-1):
+    """ Free memory of the GPU or MemAvailable of the host in bytes """
+    if gpu >= 0:
+        import cupy
+        with cupy.cuda.Device(gpu):
+            return cupy.cuda.runtime.memGetInfo()[0]
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError('MemAvailable is not in /proc/meminfo')
+
+
+def estimate_memory(model, batch_size, num_point):
+    """Estimate the memory a training iteration allocates at its peak in bytes
+
+    Args:
+        model (PointNetAE): model to train, its ``train_points`` and
+            ``chamfer_points`` are taken into account.
+        batch_size (int): batch size.
+        num_point (int): number of input points.
+
+    Returns:
+        dict of the bytes of ``params`` (grads and Adam states),
+        ``activations``, ``chamfer`` and their ``total``.
+    """
+    from chainer import links
+
+    n = num_point
+    if model.train_points is not None:
+        n = min(n, model.train_points)
+    m = min(n, model.output_points)
+    if model.chamfer_points is not None:
+        n = min(n, model.chamfer_points)
+        m = min(m, model.chamfer_points)
+    points = num_point if model.train_points is None else min(num_point, model.train_points)
+
+    params = sum(p.size for p in model.params()) * FLOAT_BYTES * 3
+    activations = batch_size * model.in_dim * points * FLOAT_BYTES
+    for link in model.links():
+        if isinstance(link, links.Convolution2D):
+            # 1x1 convolutions over every point
+            activations += ARRAYS_PER_LAYER * batch_size * link.out_channels * points * FLOAT_BYTES
+        elif isinstance(link, links.Linear):
+            activations += ARRAYS_PER_LAYER * batch_size * link.out_size * FLOAT_BYTES
+    # pairwise (B, 3, N, M) arrays and the (B, N, M) distances and their gradient
+    chamfer = CHAMFER_ARRAYS * batch_size * model.in_dim * n * m * FLOAT_BYTES
+    chamfer += 2 * batch_size * n * m * FLOAT_BYTES
+    return {'params': params, 'activations': activations, 'chamfer': chamfer,
+            'total': params + activations + chamfer}
+
+
+def _rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _iteration(model, batch_size, num_point):
+    import chainer
+    from chainer import optimizers
+    xp = model.xp
+    x = xp.asarray(np.random.uniform(-1, 1, (batch_size, model.in_dim, num_point, 1))
+                   .astype(np.float32))
+    optimizer = optimizers.Adam()
+    optimizer.setup(model)
+    with chainer.using_config('train', True):
+        model.cleargrads()
+        loss = model(x, x)
+        loss.backward()
+        optimizer.update()
+
+
+def _probe_cpu_child(model, batch_size, num_point, pipe):
+    base = _rss_bytes()
+    _iteration(model, batch_size, num_point)
+    # ru_maxrss is in KB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    pipe.send(peak - base)
+
+
+def probe_memory(model, batch_size, num_point, gpu=-1):
+    """Measure the peak memory of one training iteration in bytes
+
+    On CPU the iteration runs in a forked process and the increase of its
+    peak RSS is returned. On GPU the model is copied to the device and the
+    bytes held by the CuPy memory pool are returned. None is returned when
+    the iteration runs out of memory.
+    """
+    if gpu >= 0:
+        import copy
+        import cupy
+        pool = cupy.get_default_memory_pool()
+        pool.free_all_blocks()
+        with cupy.cuda.Device(gpu):
+            probe = copy.deepcopy(model)
+            probe.to_gpu()
+            base = pool.total_bytes()
+            try:
+                _iteration(probe, batch_size, num_point)
+                return pool.total_bytes() - base
+            except cupy.cuda.memory.OutOfMemoryError:
+                return None
+            finally:
+                del probe
+                pool.free_all_blocks()
+
+    ctx = multiprocessing.get_context('fork')
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_probe_cpu_child,
+                          args=(model, batch_size, num_point, child))
+    process.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        # killed, most likely by the OOM killer
+        result = None
+    process.join()
+    return result
+
+
+def plan_batch_size(model, num_point, budget, gpu=-1, max_batch_size=4096,
+                    probes=4, verbose=True):
+    """Largest batch size whose training iteration fits in budget bytes
+
+    The estimate is the first candidate. Each probe then moves the batch
+    size in proportion to the measured peak, up while it is comfortably
+    under the budget and down when it is over, within the bounds of the
+    previous probes, so a pessimistic estimate doesn't leave memory unused.
+
+    Args:
+        model (PointNetAE): model to train.
+        num_point (int): number of input points.
+        budget (int): memory budget in bytes.
+        gpu (int): GPU id, -1 for CPU.
+        max_batch_size (int): upper bound of the batch size.
+        probes (int): maximum number of probe iterations, 0 trusts the
+            estimate.
+        verbose (bool): print the estimates and the probes.
+
+    Returns:
+        batch size, 0 when even a batch of 1 doesn't fit.
+    """
+    fixed = estimate_memory(model, 0, num_point)['total']
+    per_sample = estimate_memory(model, 1, num_point)['total'] - fixed
+    batch_size = int(min((budget - fixed) // per_sample, max_batch_size))
+    if verbose:
+        print('budget {:.0f} MB, estimated {:.0f} MB + {:.1f} MB per sample'.format(
+            _mb(budget), _mb(fixed), _mb(per_sample)))
+    # largest batch size measured to fit and smallest one measured not to
+    fits, fails = 0, max_batch_size + 1
+    for _ in range(probes):
+        if batch_size <= fits or batch_size >= fails:
+            break
+        start = time.time()
+        measured = probe_memory(model, batch_size, num_point, gpu)
+        if verbose:
+            print('probe batch size {}: estimated {:.0f} MB, measured {} ({:.1f} sec)'.format(
+                batch_size, _mb(estimate_memory(model, batch_size, num_point)['total']),
+                'out of memory' if measured is None else '{:.0f} MB'.format(_mb(measured)),
+                time.time() - start))
+        if measured is not None and measured <= budget:
+            fits = batch_size
+            if measured > budget * GROW_MARGIN:
+                break
+        else:
+            fails = batch_size
+        if measured is None:
+            guess = (fits + fails) // 2
+        else:
+            guess = int(batch_size * budget / measured * 0.95)
+        if guess <= fits or guess >= fails:
+            # the proportional guess left the bounds, bisect them
+            guess = (fits + fails) // 2
+        batch_size = guess
+    if probes == 0 or fits == 0:
+        # not validated, like the estimate
+        return max(min(batch_size, fails - 1), 0)
+    return fits
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch size planner')
+    parser.add_argument('--num_point', '-n', type=int, default=1024)
+    parser.add_argument('--memory_budget', type=float, default=0,
+                        help='MB, 0 uses 80%% of the available memory')
+    parser.add_argument('--gpu', '-g', type=int, default=-1)
+    parser.add_argument('--chamfer_points', type=int, default=0)
+    parser.add_argument('--probes', type=int, default=4)
+    args = parser.parse_args()
+
+    import models.pointnet_ae as ae
+
+    model = ae.PointNetAE(out_dim=3, output_points=args.num_point)
+    if args.chamfer_points > 0:
+        model.chamfer_points = args.chamfer_points
+    budget = args.memory_budget * 2 ** 20 or available_memory(args.gpu) * 0.8
+
+    print('{:>6} {:>10} {:>12} {:>10} {:>10}'.format(
+        'batch', 'params MB', 'activation MB', 'chamfer MB', 'total MB'))
+    for batch_size in (1, 8, 32, 128):
+        est = estimate_memory(model, batch_size, args.num_point)
+        print('{:>6} {:>10.0f} {:>12.0f} {:>10.0f} {:>10.0f}'.format(
+            batch_size, _mb(est['params']), _mb(est['activations']),
+            _mb(est['chamfer']), _mb(est['total'])))
+    batch_size = plan_batch_size(model, args.num_point, budget, args.gpu, probes=args.probes)
+    print('batch size {}'.format(batch_size))
+
+
+if __name__ == '__main__':
+    main()
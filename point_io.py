@@ -0,0 +1,168 @@
+"""
+Fast readers for point cloud files without open3d.
+
+ASCII files are read in one go and parsed with np.fromstring. Binary PCD
+and PLY files are parsed from their header and mapped with np.memmap, so
+when the vertex record is exactly float32 x, y, z the returned array is a
+zero-copy view of the file.
+"""
+import os
+
+import numpy as np
+
+
+# np.loadtxt is implemented in C since numpy 1.23 and parses floats faster
+# than np.fromstring there, older versions parse line by line in Python
+FAST_LOADTXT = tuple(int(v) for v in np.__version__.split('.')[:2]) >= (1, 23)
+
+# PLY property types
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+
+
+def _read_text(path):
+    with open(path, 'rb') as f:
+        return f.read().decode('ascii')
+
+
+def read_pts(path, dtype=np.float32):
+    """ Read an ASCII point file (one point per line)
+        Return:
+          Nx3 array
+    """
+    if FAST_LOADTXT:
+        return np.loadtxt(path, dtype=dtype, ndmin=2).reshape(-1, 3)
+    return np.fromstring(_read_text(path), dtype=dtype, sep=' ').reshape(-1, 3)
+
+
+def read_seg(path, dtype=np.int64):
+    """ Read an ASCII label file (one label per line)
+        Return:
+          N array
+    """
+    return np.fromstring(_read_text(path), dtype=dtype, sep=' ')
+
+
+def _xyz(records):
+    # zero-copy view when the record is exactly float32 x, y, z
+    if records.dtype == np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4')]):
+        return records.view('<f4').reshape(-1, 3)
+    return np.stack([records['x'], records['y'], records['z']], axis=1)
+
+
+def _read_header(f, last_keyword):
+    lines = []
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError('unexpected end of header in {}'.format(f.name))
+        line = line.decode('ascii').strip()
+        lines.append(line)
+        if line.split() and line.split()[0] == last_keyword:
+            return lines, f.tell()
+
+
+def read_pcd(path):
+    """ Read xyz of an ascii or binary PCD file
+        Return:
+          Nx3 array
+    """
+    with open(path, 'rb') as f:
+        lines, offset = _read_header(f, 'DATA')
+    header = {}
+    for line in lines:
+        if line and not line.startswith('#'):
+            values = line.split()
+            header[values[0].upper()] = values[1:]
+    fields = header['FIELDS']
+    sizes = [int(v) for v in header['SIZE']]
+    types = header['TYPE']
+    counts = [int(v) for v in header.get('COUNT', ['1'] * len(fields))]
+    points = int(header['POINTS'][0])
+    data = header['DATA'][0]
+
+    if data == 'ascii':
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            values = np.fromstring(f.read().decode('ascii'), dtype=np.float64, sep=' ')
+        values = values.reshape(points, sum(counts))
+        columns = np.cumsum([0] + counts)
+        index = [columns[fields.index(name)] for name in ('x', 'y', 'z')]
+        return values[:, index].astype(np.float32)
+    elif data == 'binary':
+        dtype = []
+        for i, (name, size, t, count) in enumerate(zip(fields, sizes, types, counts)):
+            if name == '_':
+                name = '_{}'.format(i)
+            dtype.append((name, '<{}{}'.format(t.lower(), size), (count,) if count > 1 else ()))
+        records = np.memmap(path, dtype=np.dtype(dtype), mode='r',
+                            offset=offset, shape=(points,))
+        return _xyz(records)
+    else:
+        raise NotImplementedError('PCD DATA {} is not supported'.format(data))
+
+
+def read_ply(path):
+    """ Read xyz of the vertex element of an ascii or binary PLY file
+        Return:
+          Nx3 array
+    """
+    with open(path, 'rb') as f:
+        lines, offset = _read_header(f, 'end_header')
+    fmt = None
+    vertex_count = None
+    properties = []
+    element = None
+    for line in lines:
+        values = line.split()
+        if not values:
+            continue
+        if values[0] == 'format':
+            fmt = values[1]
+        elif values[0] == 'element':
+            element = values[1]
+            if element == 'vertex':
+                vertex_count = int(values[2])
+            elif vertex_count is None:
+                raise NotImplementedError('elements before vertex are not supported')
+        elif values[0] == 'property' and element == 'vertex':
+            if values[1] == 'list':
+                raise NotImplementedError('list properties in vertex are not supported')
+            properties.append((values[2], PLY_TYPES[values[1]]))
+
+    if fmt == 'ascii':
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            body = f.read().decode('ascii').split('\n', vertex_count)[:vertex_count]
+        values = np.fromstring(' '.join(body), dtype=np.float64, sep=' ')
+        values = values.reshape(vertex_count, len(properties))
+        names = [name for name, _ in properties]
+        index = [names.index(name) for name in ('x', 'y', 'z')]
+        return values[:, index].astype(np.float32)
+    elif fmt in ('binary_little_endian', 'binary_big_endian'):
+        endian = '<' if fmt == 'binary_little_endian' else '>'
+        dtype = np.dtype([(name, endian + t) for name, t in properties])
+        records = np.memmap(path, dtype=dtype, mode='r',
+                            offset=offset, shape=(vertex_count,))
+        return _xyz(records)
+    else:
+        raise NotImplementedError('PLY format {} is not supported'.format(fmt))
+
+
+def read_point_cloud(path):
+    """ Read xyz of a .pts, .pcd or .ply file
+        Return:
+          Nx3 array
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.pcd':
+        return read_pcd(path)
+    elif ext == '.ply':
+        return read_ply(path)
+    elif ext == '.pts':
+        return read_pts(path)
+    raise NotImplementedError('unknown point cloud file {}'.format(path))
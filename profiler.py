@@ -0,0 +1,249 @@
+"""
+Per function profiler of Chainer models.
+
+FunctionProfiler is a chainer.FunctionHook which records the call count,
+forward and backward wall time and output array bytes of every function
+node. A LinkHook keeps the stack of links being called, so each function
+is attributed to the link it was called from (e.g. ``conv_block5``,
+``fc8``, ``input_transform_net``). Backward calls are attributed to the
+link of their forward call. Functions called from ``chamfer_distance``
+are grouped under ``chamfer_distance``.
+
+    profiler = FunctionProfiler()
+    with profiler:
+        loss = model(x, t)
+        loss.backward()
+    profiler.print_report()
+    profiler.save_chrome_trace('trace.json')
+
+The trace can be opened with chrome://tracing or https://ui.perfetto.dev.
+"""
+import os
+import json
+import time
+import weakref
+import functools
+import collections
+
+import chainer
+from chainer import backends
+
+import models.distance_loss as dl
+
+
+# (module, attribute) of functions whose calls get their own group
+SCOPED_FUNCTIONS = [(dl, 'chamfer_distance')]
+
+
+def _synchronize(arrays):
+    for a in arrays:
+        if isinstance(a, backends.cuda.ndarray):
+            backends.cuda.Stream.null.synchronize()
+            return
+
+
+def _nbytes(arrays):
+    return sum(a.nbytes for a in arrays if a is not None)
+
+
+class _LinkTracker(chainer.LinkHook):
+
+    name = 'FunctionProfilerLinkTracker'
+
+    def __init__(self, stack):
+        self.stack = stack
+
+    def forward_preprocess(self, args):
+        link = args.link
+        # the model itself (or any link called directly) has no name
+        self.stack.append(link.name or '<{}>'.format(type(link).__name__))
+
+    def forward_postprocess(self, args):
+        self.stack.pop()
+
+
+class FunctionProfiler(chainer.FunctionHook):
+    """Function hook recording time and memory per function and link
+
+    Args:
+        depth (int): number of link names from the top level child of the
+            model to group by, e.g. 1 groups ``input_transform_net``
+            as a whole and 2 splits it into ``input_transform_net/trans_module``.
+        max_events (int): maximum number of events kept for the Chrome
+            trace, the aggregated statistics are not limited.
+    """
+
+    name = 'FunctionProfiler'
+
+    def __init__(self, depth=1, max_events=100000):
+        self.depth = depth
+        self.max_events = max_events
+        self.stack = []
+        self.stats = collections.OrderedDict()
+        self.events = []
+        self._link_tracker = _LinkTracker(self.stack)
+        self._starts = []
+        self._backward_depth = 0
+        self._groups = weakref.WeakKeyDictionary()
+        self._patched = []
+        self._origin = time.time()
+
+    def __enter__(self):
+        self._link_tracker.__enter__()
+        for module, attr in SCOPED_FUNCTIONS:
+            original = getattr(module, attr)
+            setattr(module, attr, self._scoped(attr, original))
+            self._patched.append((module, attr, original))
+        return super(FunctionProfiler, self).__enter__()
+
+    def __exit__(self, *args):
+        super(FunctionProfiler, self).__exit__(*args)
+        for module, attr, original in reversed(self._patched):
+            setattr(module, attr, original)
+        self._patched = []
+        self._link_tracker.__exit__(*args)
+
+    def _scoped(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.stack.append(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stack.pop()
+        return wrapper
+
+    def _group(self):
+        # drop unnamed root links unless nothing else is on the stack
+        names = [n for n in self.stack if not n.startswith('<')]
+        if not names:
+            return self.stack[-1] if self.stack else '(no link)'
+        return '/'.join(names[:self.depth])
+
+    def _entry(self, group, function_name):
+        key = (group, function_name)
+        entry = self.stats.get(key)
+        if entry is None:
+            entry = self.stats[key] = {
+                'calls': 0, 'forward': 0., 'backward': 0., 'bytes': 0}
+        return entry
+
+    def _add_event(self, name, cat, start, end, group):
+        if len(self.events) < self.max_events:
+            self.events.append({
+                'name': name, 'cat': cat, 'ph': 'X', 'pid': 0, 'tid': 0,
+                'ts': (start - self._origin) * 1e6,
+                'dur': (end - start) * 1e6,
+                'args': {'link': group}})
+
+    def forward_preprocess(self, function, in_data):
+        if self._backward_depth:
+            # functions applied by a backward are part of its time
+            self._starts.append(None)
+            return
+        _synchronize(in_data)
+        outputs = []
+        forward = function.forward
+
+        # capture the outputs, which the postprocess hook doesn't receive
+        def capture(inputs):
+            ys = forward(inputs)
+            outputs.extend(ys)
+            return ys
+        function.forward = capture
+        self._starts.append((time.time(), outputs))
+
+    def forward_postprocess(self, function, in_data):
+        started = self._starts.pop()
+        if started is None:
+            return
+        del function.forward
+        start, outputs = started
+        _synchronize(outputs)
+        end = time.time()
+        group = self._group()
+        try:
+            self._groups[function] = group
+        except TypeError:
+            pass
+        entry = self._entry(group, function.label)
+        entry['calls'] += 1
+        entry['forward'] += end - start
+        entry['bytes'] += _nbytes(outputs)
+        self._add_event(function.label, 'forward', start, end, group)
+
+    def backward_preprocess(self, function, in_data, out_grad):
+        _synchronize(out_grad)
+        self._backward_depth += 1
+        self._starts.append((time.time(), None))
+
+    def backward_postprocess(self, function, in_data, out_grad):
+        _synchronize(in_data)
+        start, _ = self._starts.pop()
+        self._backward_depth -= 1
+        end = time.time()
+        group = self._groups.get(function, '(unknown)')
+        self._entry(group, function.label)['backward'] += end - start
+        self._add_event(function.label, 'backward', start, end, group)
+
+    def summary(self, by_link=True):
+        """Return aggregated statistics
+
+        Args:
+            by_link (bool): aggregate per link, otherwise per link and
+                function.
+
+        Returns:
+            list of dicts sorted by total time, with keys ``link``,
+            ``function`` (only when by_link is False), ``calls``,
+            ``forward``, ``backward`` (seconds) and ``bytes``.
+        """
+        rows = collections.OrderedDict()
+        for (group, function_name), entry in self.stats.items():
+            key = group if by_link else (group, function_name)
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = {'link': group, 'calls': 0, 'forward': 0.,
+                                   'backward': 0., 'bytes': 0}
+                if not by_link:
+                    row['function'] = function_name
+            for k in ('calls', 'forward', 'backward', 'bytes'):
+                row[k] += entry[k]
+        return sorted(rows.values(),
+                      key=lambda r: r['forward'] + r['backward'], reverse=True)
+
+    def report(self, by_link=True):
+        rows = self.summary(by_link)
+        total = sum(r['forward'] + r['backward'] for r in rows) or 1.
+        name_width = max([len(self._row_name(r)) for r in rows] + [8])
+        lines = ['{:<{w}} {:>8} {:>11} {:>12} {:>7} {:>11}'.format(
+            'link' if by_link else 'link:function', 'calls', 'forward ms',
+            'backward ms', '%', 'output MB', w=name_width)]
+        for r in rows:
+            lines.append('{:<{w}} {:>8d} {:>11.2f} {:>12.2f} {:>7.1f} {:>11.2f}'.format(
+                self._row_name(r), r['calls'], r['forward'] * 1000,
+                r['backward'] * 1000,
+                (r['forward'] + r['backward']) / total * 100,
+                r['bytes'] / 2. ** 20, w=name_width))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _row_name(row):
+        if 'function' in row:
+            return '{}:{}'.format(row['link'], row['function'])
+        return row['link']
+
+    def print_report(self, by_link=True):
+        print(self.report(by_link))
+
+    def save_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+    def save(self, out_dir):
+        """Write profile.txt (per link and per function tables) and
+        profile_trace.json to out_dir."""
+        with open(os.path.join(out_dir, 'profile.txt'), 'w') as f:
+            f.write(self.report(by_link=True) + '\n\n')
+            f.write(self.report(by_link=False) + '\n')
+        self.save_chrome_trace(os.path.join(out_dir, 'profile_trace.json'))
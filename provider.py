@@ -9,7 +9,6 @@ It uses `wget` and it does not work on Windows.
 import os
 import sys
 import numpy as np
-import h5py
 
 def download_dataset():
   BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -98,6 +97,7 @@ def getDataFiles(list_filename):
     return [line.rstrip() for line in open(list_filename)]
 
 def load_h5(h5_filename):
+    import h5py
     f = h5py.File(h5_filename)
     data = f['data'][:]
     label = f['label'][:]
@@ -107,6 +107,7 @@ def loadDataFile(filename):
     return load_h5(filename)
 
 def load_h5_data_label_seg(h5_filename):
+    import h5py
     f = h5py.File(h5_filename)
     data = f['data'][:]
     label = f['label'][:]
@@ -0,0 +1,113 @@
+import numpy as np
+
+import chainer
+
+
+class ImportanceSamplingIterator(chainer.dataset.Iterator):
+    """Iterator sampling shapes with a high reconstruction loss more often
+
+    For the first ``warmup`` epochs the dataset is iterated in shuffled
+    order like SerialIterator. Afterwards, sample ``i`` is drawn with
+    probability ``p_i = floor / n + (1 - floor) * l_i / sum(l)``, where
+    ``l_i`` is its latest per sample Chamfer distance read back from
+    ``target.sample_losses`` (see PointNetAE). Each example is returned
+    with an extra importance weight ``1 / (n * p_i)``, which PointNetAE
+    multiplies the per sample losses with, so the gradient stays unbiased.
+    An epoch is ``n`` drawn samples.
+
+    Args:
+        dataset: dataset returning (x, y) tuples.
+        batch_size (int): number of examples per batch.
+        target (chainer.Link): model exposing ``sample_losses``.
+        warmup (int): epochs of uniform sampling.
+        floor (float): mixing ratio of the uniform distribution, the
+            weights are bounded by ``1 / floor``.
+    """
+
+    def __init__(self, dataset, batch_size, target, warmup=1, floor=0.2):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.target = target
+        self.warmup = warmup
+        self.floor = floor
+        self.losses = np.full(len(dataset), np.nan, dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        self.current_position = 0
+        self.epoch = 0
+        self.is_new_epoch = False
+        self._previous_epoch_detail = -1.
+        self._order = np.random.permutation(len(self.dataset))
+        self._last_indices = None
+
+    def _feedback(self):
+        if self._last_indices is None:
+            return
+        losses = getattr(self.target, 'sample_losses', None)
+        if losses is not None and len(losses) == len(self._last_indices):
+            self.losses[self._last_indices] = chainer.backends.cuda.to_cpu(losses)
+            self.target.sample_losses = None
+        self._last_indices = None
+
+    def probabilities(self):
+        n = len(self.dataset)
+        losses = self.losses
+        if np.all(np.isnan(losses)):
+            return np.full(n, 1. / n)
+        # samples never seen get the mean loss
+        losses = np.where(np.isnan(losses), np.nanmean(losses), losses)
+        losses = np.maximum(losses, 0)
+        total = losses.sum()
+        if total <= 0:
+            return np.full(n, 1. / n)
+        p = self.floor / n + (1 - self.floor) * losses / total
+        return p / p.sum()
+
+    def __next__(self):
+        self._feedback()
+        n = len(self.dataset)
+        self._previous_epoch_detail = self.epoch_detail
+
+        if self.epoch < self.warmup:
+            if self.current_position == 0:
+                self._order = np.random.permutation(n)
+            indices = self._order[self.current_position:
+                                  self.current_position + self.batch_size]
+            weights = np.ones(len(indices), dtype=np.float32)
+        else:
+            p = self.probabilities()
+            indices = np.random.choice(n, self.batch_size, p=p)
+            weights = (1. / (n * p[indices])).astype(np.float32)
+
+        self.current_position += len(indices)
+        if self.current_position >= n:
+            self.current_position = 0
+            self.epoch += 1
+            self.is_new_epoch = True
+        else:
+            self.is_new_epoch = False
+
+        self._last_indices = indices
+        return [tuple(self.dataset[i]) + (w,) for i, w in zip(indices, weights)]
+
+    next = __next__
+
+    @property
+    def epoch_detail(self):
+        return self.epoch + self.current_position / len(self.dataset)
+
+    @property
+    def previous_epoch_detail(self):
+        if self._previous_epoch_detail < 0:
+            return None
+        return self._previous_epoch_detail
+
+    def serialize(self, serializer):
+        self.current_position = serializer('current_position', self.current_position)
+        self.epoch = serializer('epoch', self.epoch)
+        self.is_new_epoch = serializer('is_new_epoch', self.is_new_epoch)
+        self._previous_epoch_detail = serializer(
+            'previous_epoch_detail', self._previous_epoch_detail)
+        serializer('losses', self.losses)
+        serializer('order', self._order)
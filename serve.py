@@ -0,0 +1,262 @@
+"""
+Local anomaly scoring server with dynamic micro-batching.
+
+The checkpoint is loaded once. Incoming point clouds are queued and a
+batcher thread groups them into micro-batches of at most --max_batch
+clouds, waiting at most --max_wait_ms for a batch to fill, then scores the
+whole batch in one forward pass.
+
+    python serve.py -lf result/model.npz --port 8000
+    python serve.py -lf result/model.npz --unix_socket /tmp/pointnet_ae.sock
+
+POST /score with a JSON body {"points": [[x, y, z], ...]} or raw float32
+xyz bytes (Content-Type: application/octet-stream) returns
+{"score": chamfer distance, "anomaly": 1 (normal) or -1, "batch_size": k}.
+GET /stats returns latency percentiles and the batch size histogram.
+"""
+import numpy as np
+import os
+import json
+import time
+import queue
+import socket
+import argparse
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from distutils.util import strtobool
+
+# self made
+import dataset
+
+
+class _Request(object):
+
+    def __init__(self, points):
+        self.points = points
+        self.start = time.time()
+        self.done = threading.Event()
+        self.score = None
+        self.batch_size = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    """Group single clouds into batches and score them with PointNetAE
+
+    Args:
+        model (PointNetAE): trained model.
+        num_point (int): number of points fed to the model.
+        max_batch (int): maximum number of clouds in a batch.
+        max_wait (float): maximum seconds to wait for a batch to fill.
+        device (int): gpu id, negative for cpu.
+        normalize (bool): normalize clouds like the training dataset.
+    """
+
+    def __init__(self, model, num_point, max_batch=32, max_wait=0.005,
+                 device=-1, normalize=True, history=10000):
+        self.model = model
+        self.num_point = num_point
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.device = device
+        self.normalize = normalize
+        self._queue = queue.Queue()
+        self._latencies = collections.deque(maxlen=history)
+        self._batch_sizes = collections.Counter()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def score(self, points):
+        """Block until ``points`` (Nx3) is scored, return (score, batch size)"""
+        request = _Request(points)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.score, request.batch_size
+
+    def _preprocess(self, points):
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        # like the training dataset: normalize the whole cloud, then resample
+        if self.normalize:
+            points = dataset.pc_normalize(points)
+        choice = np.random.choice(len(points), self.num_point, replace=True)
+        points = points[choice, :]
+        # (N, 3) -> (3, N, 1)
+        return points.T[:, :, None]
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        import chainer
+        while True:
+            batch = self._next_batch()
+            try:
+                x = np.stack([self._preprocess(r.points) for r in batch])
+                x = chainer.dataset.to_device(self.device, x)
+                with chainer.using_config('train', False), chainer.no_backprop_mode():
+                    scores = chainer.backends.cuda.to_cpu(self.model.anomaly_scores(x))
+                for r, s in zip(batch, scores):
+                    r.score = float(s)
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+            end = time.time()
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                for r in batch:
+                    self._latencies.append(end - r.start)
+            for r in batch:
+                r.batch_size = len(batch)
+                r.done.set()
+
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self._latencies)
+            histogram = dict(self._batch_sizes)
+        result = {'requests': int(sum(k * v for k, v in histogram.items())),
+                  'batches': int(sum(histogram.values())),
+                  'batch_size_histogram': {str(k): v for k, v in sorted(histogram.items())}}
+        if len(latencies):
+            for p in (50, 90, 99):
+                result['latency_p{}_ms'.format(p)] = float(np.percentile(latencies, p) * 1000)
+        return result
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    batcher = None
+    threshold = None
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(self.batcher.stats())
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        if self.path != '/score':
+            self._send_json({'error': 'not found'}, 404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            if self.headers.get('Content-Type') == 'application/octet-stream':
+                points = np.frombuffer(body, dtype=np.float32).reshape(-1, 3)
+            else:
+                points = np.array(json.loads(body.decode())['points'], dtype=np.float32)
+            if points.ndim != 2 or points.shape[1] != 3 or len(points) == 0:
+                raise ValueError('points must be a non-empty Nx3 array')
+        except (ValueError, KeyError, TypeError) as e:
+            # TypeError: the JSON body is not an object
+            self._send_json({'error': str(e)}, 400)
+            return
+        try:
+            score, batch_size = self.batcher.score(points)
+        except Exception as e:
+            self._send_json({'error': 'scoring failed: {}'.format(e)}, 500)
+            return
+        anomaly = 1 if score <= self.threshold else -1
+        self._send_json({'score': score, 'anomaly': anomaly, 'batch_size': batch_size})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        self.socket.bind(self.server_address)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('local', 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='AutoEncoder anomaly scoring server')
+    parser.add_argument('--dropout_ratio', type=float, default=0)
+    parser.add_argument('--trans', type=strtobool, default='true')
+    parser.add_argument('--use_bn', type=strtobool, default='true')
+    parser.add_argument('--residual', type=strtobool, default='false')
+    parser.add_argument('--out_dim', type=int, default=3)
+    parser.add_argument('--in_dim', type=int, default=3)
+    parser.add_argument('--middle_dim', type=int, default=64)
+    parser.add_argument('--load_file', '-lf', type=str, default='result/model.npz')
+    parser.add_argument('--num_point', type=int, default=1024)
+    parser.add_argument('--normalize', type=strtobool, default='true')
+    parser.add_argument('--gpu', '-g', type=int, default=-1)
+    parser.add_argument('--max_batch', type=int, default=32)
+    parser.add_argument('--max_wait_ms', type=float, default=5)
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix_socket', type=str, default=None)
+    args = parser.parse_args()
+
+    # chainer is imported after parsing, so that --help and errors are fast
+    import chainer
+    from chainer import serializers
+    import models.pointnet_ae as ae
+
+    print('Load PointNet-AutoEncoder model... load_file={}'.format(args.load_file))
+    model = ae.PointNetAE(out_dim=args.out_dim, in_dim=args.in_dim, middle_dim=args.middle_dim,
+                          dropout_ratio=args.dropout_ratio, use_bn=args.use_bn, trans=args.trans,
+                          residual=args.residual, output_points=args.num_point)
+    serializers.load_npz(args.load_file, model)
+    if args.gpu >= 0:
+        chainer.backends.cuda.get_device_from_id(args.gpu).use()
+        model.to_gpu()
+
+    _Handler.threshold = ae.ANOMALY_THRESHOLD
+    _Handler.batcher = MicroBatcher(model, args.num_point, max_batch=args.max_batch,
+                                    max_wait=args.max_wait_ms / 1000., device=args.gpu,
+                                    normalize=args.normalize)
+    if args.unix_socket:
+        server = ThreadingUnixHTTPServer(args.unix_socket, _Handler)
+        print('listening on', args.unix_socket)
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), _Handler)
+        print('listening on {}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
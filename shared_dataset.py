@@ -0,0 +1,203 @@
+"""
+ShapeNet datasets shared between processes through named shared memory.
+
+The first process which creates a ChainerPointCloudDatasetShared (see
+chainer_dataset.py) parses the files like ChainerPointCloudDatasetDefault
+and publishes the data, labels and class maps as .npy files in a
+directory of /dev/shm, named by a hash of the dataset arguments. Later processes with the same arguments
+attach to them read-only with np.load(mmap_mode='r'), so N concurrent jobs
+share the pages of one copy and skip the parsing. Each attached process
+holds a reference file named by its pid, and the segment is removed when
+the last process closes the dataset or exits. References of dead
+processes are pruned.
+
+Run this script to keep segments published between jobs:
+
+    python shared_dataset.py --split train,val,test --class_choice Chair
+    python shared_dataset.py --list
+    python shared_dataset.py --cleanup
+"""
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import argparse
+import tempfile
+import contextlib
+from distutils.util import strtobool
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ROOT = os.path.join(BASE_DIR, 'data/shapenetcore_partanno_segmentation_benchmark_v0')
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+PREFIX = 'pointnet_ae_'
+
+
+def segment_name(root, num_point, classification, class_choice, split, normalize):
+    """ Name of the segment of a dataset, a hash of its arguments """
+    key = json.dumps([os.path.abspath(root), num_point, bool(classification),
+                      None if class_choice is None else sorted(class_choice),
+                      split, bool(normalize)])
+    return PREFIX + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+@contextlib.contextmanager
+def lock(path):
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _refs(path):
+    # pids of the live processes attached to the segment, stale ones are removed
+    ref_dir = os.path.join(path, 'refs')
+    pids = []
+    for fn in os.listdir(ref_dir):
+        pid = int(fn)
+        if _alive(pid):
+            pids.append(pid)
+        else:
+            os.remove(os.path.join(ref_dir, fn))
+    return pids
+
+
+def publish(path, arrays, meta):
+    """ Write arrays (dict of name to array) and meta (json) to path """
+    tmp = '{}.tmp.{}'.format(path, os.getpid())
+    os.makedirs(os.path.join(tmp, 'refs'))
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, name + '.npy'), array)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    # the segment only appears when it is complete
+    os.rename(tmp, path)
+
+
+def attach(path):
+    """ Map the arrays of path read-only, return (arrays, meta) """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    arrays = {}
+    for fn in os.listdir(path):
+        if fn.endswith('.npy'):
+            arrays[fn[:-4]] = np.load(os.path.join(path, fn), mmap_mode='r')
+    return arrays, meta
+
+
+def acquire(path):
+    open(os.path.join(path, 'refs', str(os.getpid())), 'w').close()
+
+
+def release(path):
+    """ Drop the reference of this process, remove the segment if it was
+        the last one. Return True when the segment was removed. """
+    with lock(path):
+        if not os.path.isdir(path):
+            return False
+        ref = os.path.join(path, 'refs', str(os.getpid()))
+        if os.path.exists(ref):
+            os.remove(ref)
+        if _refs(path):
+            return False
+        shutil.rmtree(path)
+        return True
+
+
+def list_segments(shm_dir=SHM_DIR):
+    """ Return [(path, bytes, pids)] of the published segments """
+    segments = []
+    for fn in sorted(os.listdir(shm_dir)):
+        path = os.path.join(shm_dir, fn)
+        if not fn.startswith(PREFIX) or '.' in fn or not os.path.isdir(path):
+            continue
+        with lock(path):
+            if not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f))
+                       for f in os.listdir(path) if f.endswith('.npy'))
+            segments.append((path, size, _refs(path)))
+    return segments
+
+
+def cleanup(shm_dir=SHM_DIR, force=False):
+    """ Remove segments without live references (all of them with force)
+        and files left by interrupted publishes. Return removed paths. """
+    removed = []
+    for path, _, pids in list_segments(shm_dir):
+        if force or not pids:
+            with lock(path):
+                shutil.rmtree(path, ignore_errors=True)
+            removed.append(path)
+    for fn in os.listdir(shm_dir):
+        path = os.path.join(shm_dir, fn)
+        if not fn.startswith(PREFIX):
+            continue
+        if '.tmp.' in fn and not _alive(int(fn.rsplit('.', 1)[1])):
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path)
+        elif fn.endswith('.lock') and not os.path.exists(path[:-len('.lock')]):
+            os.remove(path)
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Publish ShapeNet datasets in shared memory')
+    parser.add_argument('--split', type=str, default='train,val,test')
+    parser.add_argument('--class_choice', '-c', type=str, default='Chair',
+                        help='class name, comma separated names or all')
+    parser.add_argument('--num_point', '-n', type=int, default=1024)
+    parser.add_argument('--normalize', type=strtobool, default='true')
+    parser.add_argument('--list', type=strtobool, default='false')
+    parser.add_argument('--cleanup', type=strtobool, default='false')
+    parser.add_argument('--force', type=strtobool, default='false',
+                        help='--cleanup also removes segments in use')
+    args = parser.parse_args()
+
+    if args.list or args.cleanup:
+        if args.cleanup:
+            for path in cleanup(force=args.force):
+                print('removed', path)
+        for path, size, pids in list_segments():
+            print('{} {:.1f} MB pids {}'.format(path, size / 2. ** 20, pids))
+        return
+
+    # chainer is only imported to build the datasets
+    from chainer_dataset import ChainerPointCloudDatasetShared
+
+    class_choice = None if args.class_choice == 'all' else args.class_choice.split(',')
+    datasets = []
+    for split in args.split.split(','):
+        d = ChainerPointCloudDatasetShared(num_point=args.num_point, class_choice=class_choice,
+                                           split=split, normalize=args.normalize)
+        datasets.append(d)
+        print('{} {} samples {} {}'.format(
+            split, len(d), 'published to' if d.published else 'attached to', d.path))
+    print('holding the datasets, press Ctrl-C to release them')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    for d in datasets:
+        d.close()
+
+
+if __name__ == '__main__':
+    main()
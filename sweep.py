@@ -0,0 +1,184 @@
+"""
+Train several PointNet-AutoEncoder models (classes and/or hyperparameters)
+from a single parsed copy of the dataset.
+
+The dataset is loaded once in the parent process, then each run is
+trained in a forked worker which shares the parsed arrays copy-on-write.
+At most --jobs runs are trained at the same time. The final metrics of
+each run are written to <out>/summary.json and printed as a table. A run
+which raises is recorded with its traceback under "error" and doesn't stop
+the others.
+
+    OMP_NUM_THREADS=2 python sweep.py -c all --dropout_ratio 0,0.3 -j 8
+"""
+import chainer
+from chainer import serializers
+from chainer import optimizers
+from chainer import training
+from chainer import iterators
+from chainer.training import extensions as E
+from chainer.dataset.convert import concat_examples
+
+import numpy as np
+import os
+import json
+import time
+import itertools
+import traceback
+import argparse
+import multiprocessing
+from distutils.util import strtobool
+
+# self made
+import models.pointnet_ae as ae
+import dataset
+import extensions
+
+# parsed datasets, set in the parent before forking the workers
+_train = None
+_val = None
+
+
+def _class_subset(d, class_name):
+    # no copy of the data, only the indices of the class
+    mask = d.label == d.class_number[class_name]
+    # SubDataset needs a full permutation, the class comes first
+    order = np.concatenate([np.where(mask)[0], np.where(~mask)[0]])
+    return chainer.datasets.SubDataset(d, 0, int(mask.sum()), order=order)
+
+
+def run(config):
+    """Train one model described by ``config`` and return its final metrics
+
+    Exceptions are returned as the ``error`` entry of the result, so that
+    one failing configuration doesn't discard the others.
+    """
+    try:
+        return _run(config)
+    except Exception:
+        error = traceback.format_exc()
+        print('run {} failed:\n{}'.format(config['out'], error))
+        result = dict(config)
+        result['error'] = error
+        return result
+
+
+def _run(config):
+    out_dir = config['out']
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'args.json'), 'w') as f:
+        json.dump(config, f, indent=4)
+    np.random.seed(config['seed'])
+
+    model = ae.PointNetAE(out_dim=3, in_dim=3, middle_dim=64, dropout_ratio=config['dropout_ratio'],
+                          use_bn=config['use_bn'], trans=config['trans'], trans_lam1=0.001, trans_lam2=0.001,
+                          residual=config['residual'], output_points=config['num_point'])
+    train = _class_subset(_train, config['class_choice'])
+    train_iter = iterators.SerialIterator(train, config['batchsize'])
+
+    optimizer = optimizers.Adam()
+    optimizer.setup(model)
+    updater = training.StandardUpdater(train_iter, optimizer, converter=concat_examples)
+    trainer = training.Trainer(updater, (config['epoch'], 'epoch'), out=out_dir)
+
+    from chainerex.training.extensions import schedule_optimizer_value
+    trainer.extend(schedule_optimizer_value(
+        [10, 20, 100, 150, 200, 230],
+        [0.003, 0.001, 0.0003, 0.0001, 0.00003, 0.00001]))
+    if _val is not None:
+        val = _class_subset(_val, config['class_choice'])
+        trainer.extend(extensions.CachedEvaluator(val, model, config['batchsize']),
+                       trigger=extensions.interval_or_last_trigger(config['eval_interval'], config['epoch']))
+    log_report = E.LogReport()
+    trainer.extend(log_report)
+
+    start = time.time()
+    trainer.run()
+    model_path = os.path.join(out_dir, 'model.npz')
+    serializers.save_npz(model_path, model)
+
+    result = dict(config)
+    result['elapsed_time'] = time.time() - start
+    result['model'] = model_path
+    for entry in log_report.log:
+        for key in ('main/dist_loss', 'validation/main/dist_loss'):
+            if key in entry:
+                result[key] = entry[key]
+    return result
+
+
+def print_summary(results, keys):
+    columns = keys + ['main/dist_loss', 'validation/main/dist_loss', 'elapsed_time']
+    print('  '.join('{:>14}'.format(c[-14:]) for c in columns))
+    for result in results:
+        row = []
+        for c in columns:
+            value = result.get(c, '')
+            if isinstance(value, float):
+                value = '{:.5g}'.format(value)
+            row.append('{:>14}'.format(str(value)[-14:]))
+        print('  '.join(row))
+    failed = [result['out'] for result in results if 'error' in result]
+    if failed:
+        print('{} failed runs, see "error" in summary.json: {}'.format(len(failed), ', '.join(failed)))
+
+
+def main():
+    global _train, _val
+    parser = argparse.ArgumentParser(
+        description='AutoEncoder ShapeNet sweep')
+    parser.add_argument('--class_choice', '-c', type=str, default='Chair',
+                        help='comma separated class names or "all"')
+    parser.add_argument('--dropout_ratio', type=str, default='0')
+    parser.add_argument('--trans', '-t', type=str, default='true')
+    parser.add_argument('--use_bn', type=str, default='true')
+    parser.add_argument('--residual', type=strtobool, default='false')
+    parser.add_argument('--batchsize', '-b', type=int, default=32)
+    parser.add_argument('--num_point', '-n', type=int, default=1024)
+    parser.add_argument('--epoch', '-e', type=int, default=250)
+    parser.add_argument('--use_val', '-v', type=strtobool, default='true')
+    parser.add_argument('--eval_interval', type=int, default=1)
+    parser.add_argument('--jobs', '-j', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--out', '-o', type=str, default='result/sweep')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    class_choice = None if args.class_choice == 'all' else args.class_choice.split(',')
+    print('Dataset setting... class_choice={} num_point={}'.format(args.class_choice, args.num_point))
+    _train = dataset.ChainerPointCloudDatasetDefault(split='train', class_choice=class_choice,
+                                                     num_point=args.num_point)
+    if args.use_val:
+        _val = dataset.ChainerPointCloudDatasetDefault(split='val', class_choice=class_choice,
+                                                       num_point=args.num_point)
+    classes = [_train.class_name[i] for i in sorted(_train.class_name)]
+
+    grid = {
+        'class_choice': classes,
+        'dropout_ratio': [float(v) for v in args.dropout_ratio.split(',')],
+        'trans': [bool(strtobool(v)) for v in args.trans.split(',')],
+        'use_bn': [bool(strtobool(v)) for v in args.use_bn.split(',')],
+    }
+    keys = sorted(grid)
+    configs = []
+    for values in itertools.product(*[grid[k] for k in keys]):
+        config = dict(zip(keys, values))
+        name = '_'.join('{}-{}'.format(k, config[k]) for k in keys)
+        config.update(out=os.path.join(args.out, name), residual=bool(args.residual),
+                      batchsize=args.batchsize, num_point=args.num_point, epoch=args.epoch,
+                      eval_interval=args.eval_interval, seed=args.seed)
+        configs.append(config)
+
+    print('{} runs, {} at a time'.format(len(configs), args.jobs))
+    # fork after loading, so that the workers share the parsed arrays
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(processes=min(args.jobs, len(configs)), maxtasksperchild=1) as pool:
+        results = pool.map(run, configs, chunksize=1)
+
+    os.makedirs(args.out, exist_ok=True)
+    with open(os.path.join(args.out, 'summary.json'), 'w') as f:
+        json.dump(results, f, indent=4)
+    print_summary(results, keys)
+
+
+if __name__ == '__main__':
+    main()
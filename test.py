@@ -1,26 +1,69 @@
-import chainer
-from chainer import serializers
-from chainer import functions
-from chainer import optimizers
-from chainer import training
-from chainer import iterators
-from chainer.dataset import to_device
-from chainer.datasets import TransformDataset
-from chainer.training import extensions as E
-from chainer.dataset.convert import concat_examples
-from chainer.datasets.concatenated_dataset import ConcatenatedDataset
-
 import numpy as np
 import os
+import time
 import argparse
+import contextlib
 from distutils.util import strtobool
 
-# self made
-import models.pointnet_ae as ae
-import dataset
-
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+def evaluate(model, d, batch_size=32, device=-1, recon_h5=None):
+    """Reconstruct the whole dataset and compute Chamfer statistics
+
+    Returns per sample Chamfer distances (same scale as dist_loss), their
+    labels and the number of samples per second.
+    """
+    import chainer
+    from chainer.dataset.convert import concat_examples
+    import models.pointnet_ae as ae
+
+    num = len(d)
+    num_point = model.output_points
+    chamfer = np.empty(num, dtype=np.float32)
+    labels = np.asarray(d.get_label_array())[:num]
+    h5 = None
+    if recon_h5:
+        import h5py
+        h5 = h5py.File(recon_h5, 'w')
+        recon = h5.create_dataset('reconstruction', (num, num_point, 3), dtype=np.float32,
+                                  chunks=(min(batch_size, num), num_point, 3))
+        h5.create_dataset('label', data=labels)
+
+    start = time.time()
+    with chainer.using_config('train', False), chainer.no_backprop_mode():
+        for i in range(0, num, batch_size):
+            x, _ = concat_examples([d[j] for j in range(i, min(i + batch_size, num))], device)
+            y, _, _ = model.calc(x)
+            dists = ae.calc_chamfer_distance_per_sample(y, x)
+            chamfer[i:i + len(x)] = chainer.backends.cuda.to_cpu(dists.array)
+            if h5 is not None:
+                # (B, 3, N, 1) -> (B, N, 3)
+                recon[i:i + len(x)] = chainer.backends.cuda.to_cpu(y.array)[:, :, :, 0].transpose(0, 2, 1)
+    throughput = num / (time.time() - start)
+
+    if h5 is not None:
+        h5.create_dataset('chamfer', data=chamfer)
+        h5.close()
+    return chamfer, labels, throughput
+
+def print_statistics(chamfer, labels, class_name):
+    print('{:>12} {:>6} {:>10} {:>10} {:>10} {:>10}'.format('class', 'num', 'mean', 'std', 'median', 'max'))
+    rows = [(class_name[c], chamfer[labels == c]) for c in sorted(class_name)]
+    rows.append(('all', chamfer))
+    for name, values in rows:
+        if len(values) == 0:
+            continue
+        print('{:>12} {:>6d} {:>10.5f} {:>10.5f} {:>10.5f} {:>10.5f}'.format(
+            name, len(values), values.mean(), values.std(), np.median(values), values.max()))
+
+def report_profile(prof, load_file):
+    if prof is None:
+        return
+    prof.print_report(by_link=False)
+    out_dir = os.path.dirname(load_file) or '.'
+    prof.save(out_dir)
+    print('save profile to', os.path.join(out_dir, 'profile.txt'))
+
 def main():
     parser = argparse.ArgumentParser(
         description='AutoEncoder ShapeNet')
@@ -32,11 +75,30 @@ def main():
     parser.add_argument('--in_dim', type=int, default=3)
     parser.add_argument('--middle_dim', type=int, default=64)
     parser.add_argument('--load_file', '-lf', type=str, default='result/model.npz')
-    parser.add_argument('--class_choice', type=str, default='Chair')
+    parser.add_argument('--class_choice', type=str, default='Chair',
+                        help='comma separated class names or "all"')
     parser.add_argument('--extension', type=str, default='default')
     parser.add_argument('--num_point', type=int, default=1024)
+    parser.add_argument('--mode', type=str, default='view', choices=['view', 'eval'])
+    parser.add_argument('--batchsize', '-b', type=int, default=32)
+    parser.add_argument('--gpu', '-g', type=int, default=-1)
+    parser.add_argument('--device', '-d', type=str, default='numpy', choices=['numpy', 'intel64'],
+                        help='CPU backend, intel64 uses iDeep when it is installed')
+    parser.add_argument('--recon_h5', type=str, default=None)
+    parser.add_argument('--profile', type=strtobool, default='false')
+    parser.add_argument('--shared_memory', type=strtobool, default='false',
+                        help='share the parsed dataset with other jobs, see shared_dataset.py')
     args = parser.parse_args()
 
+    # chainer is imported after parsing, so that --help and errors are fast
+    import chainer
+    from chainer import serializers
+
+    # self made
+    import models.pointnet_ae as ae
+    import dataset
+    import devices
+
     dropout_ratio = args.dropout_ratio
     trans = args.trans
     use_bn = args.use_bn
@@ -47,6 +109,10 @@ def main():
     class_choice = args.class_choice
     load_file = args.load_file
     num_point = args.num_point
+    mode = args.mode
+    batch_size = args.batchsize
+    device = args.gpu
+    recon_h5 = args.recon_h5
 
     trans_lam1 = 0.001
     trans_lam2 = 0.001
@@ -56,17 +122,36 @@ def main():
                           trans=trans, trans_lam1=trans_lam1, trans_lam2=trans_lam2, residual=residual,output_points=num_point)
     serializers.load_npz(load_file, model)
 
-    d = dataset.ChainerPointCloudDatasetDefault(split="test", class_choice=[class_choice],num_point=num_point)
+    class_choice = None if class_choice == 'all' else class_choice.split(',')
+    if args.shared_memory:
+        d = dataset.ChainerPointCloudDatasetShared(split="test", class_choice=class_choice,num_point=num_point)
+    else:
+        d = dataset.ChainerPointCloudDatasetDefault(split="test", class_choice=class_choice,num_point=num_point)
+
+    prof = None
+    if args.profile:
+        import profiler
+        prof = profiler.FunctionProfiler()
+
+    if mode == 'eval':
+        devices.setup_device(model, device, args.device)
+        with prof or contextlib.nullcontext():
+            chamfer, labels, throughput = evaluate(model, d, batch_size, device, recon_h5)
+        report_profile(prof, load_file)
+        print_statistics(chamfer, labels, d.class_name)
+        print('{} samples, {:.1f} samples/sec'.format(len(d), throughput))
+        if recon_h5:
+            print('save reconstructions to', recon_h5)
+        return
 
     x,_ = d.get_example(0)
     x = chainer.Variable(np.array([x]))
-    with chainer.using_config('train', False), chainer.using_config('enable_backprop', False):
+    with chainer.using_config('train', False), chainer.using_config('enable_backprop', False), \
+            prof or contextlib.nullcontext():
         y, t1, t2 = model.calc(x)
-    y = y.array[0]
-    point_data = []
-    for n in range(len(y[0])):
-        point_data.append([y[0][n][0],y[1][n][0],y[2][n][0]])
-    point_data = np.array(point_data)
+    report_profile(prof, load_file)
+    # (3, N, 1) -> (N, 3)
+    point_data = y.array[0, :, :, 0].T
     #print(point_data)
 
     from utils import show3d_balls
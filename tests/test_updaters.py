@@ -0,0 +1,51 @@
+import os
+import sys
+import copy
+
+import numpy as np
+import chainer
+from chainer import iterators
+from chainer import optimizers
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import updaters
+import models.pointnet_ae as ae
+
+
+def _clouds(n, num_point):
+    rng = np.random.RandomState(0)
+    x = rng.uniform(-1, 1, (n, 3, num_point, 1)).astype(np.float32)
+    return [(x[i], x[i, :, :, 0].T.copy()) for i in range(n)]
+
+
+def test_bn_effective_batch_equals_full_batch_statistics():
+    np.random.seed(0)
+    num_point, batchsize, accumulate = 32, 4, 2
+    model = ae.PointNetAE(out_dim=3, dropout_ratio=0, output_points=num_point)
+    reference = copy.deepcopy(model)
+    data = _clouds(batchsize * accumulate, num_point)
+
+    optimizer = optimizers.SGD(lr=0)
+    optimizer.setup(model)
+    it = iterators.SerialIterator(data, batchsize, shuffle=False)
+    updater = updaters.GradientAccumulationUpdater(
+        it, optimizer, accumulate=accumulate, bn_effective_batch=True)
+    reporter = chainer.Reporter()
+    reporter.add_observer('main', model)
+    reporter.add_observer('reference', reference)
+    with reporter.scope({}):
+        updater.update()
+        x, y = chainer.dataset.concat_examples(data)
+        with chainer.using_config('train', True):
+            reference(x, y)
+
+    bn_links = dict(model.namedlinks())
+    reference_links = dict(reference.namedlinks())
+    names = [name for name, link in bn_links.items()
+             if isinstance(link, chainer.links.BatchNormalization)]
+    assert names
+    for name in names:
+        np.testing.assert_allclose(
+            bn_links[name].avg_mean, reference_links[name].avg_mean, rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(
+            bn_links[name].avg_var, reference_links[name].avg_var, rtol=1e-4, atol=1e-5)
@@ -1,56 +1,109 @@
-import chainer
-from chainer import serializers
-from chainer import functions
-from chainer import optimizers
-from chainer import training
-from chainer import iterators
-from chainer.dataset import to_device
-from chainer.datasets import TransformDataset
-from chainer.training import extensions as E
-from chainer.dataset.convert import concat_examples
-from chainer.datasets.concatenated_dataset import ConcatenatedDataset
-
 import numpy as np
 import os
 import argparse
 from distutils.util import strtobool
 
-# self made
-import models.pointnet_ae as ae
-import dataset
-
 def main():
     parser = argparse.ArgumentParser(
         description='AutoEncoder ShapeNet')
     # parser.add_argument('--conv-layers', '-c', type=int, default=4)
-    parser.add_argument('--batchsize', '-b', type=int, default=32)
+    parser.add_argument('--batchsize', '-b', type=str, default='32',
+                        help='batch size, or auto for the largest one fitting --memory_budget')
+    parser.add_argument('--memory_budget', type=float, default=0,
+                        help='MB for --batchsize auto, 0 uses 80%% of the available memory')
     parser.add_argument('--dropout_ratio', type=float, default=0)
     parser.add_argument('--num_point', '-n', type=int, default=1024)
+    parser.add_argument('--packed', type=strtobool, default='false',
+                        help='pack clouds of their own size, at most --num_point, along the point axis')
     parser.add_argument('--gpu', '-g', type=int, default=-1)
+    parser.add_argument('--device', '-d', type=str, default='numpy', choices=['numpy', 'intel64'],
+                        help='CPU backend, intel64 uses iDeep when it is installed')
+    parser.add_argument('--processes', '-p', type=int, default=1)
+    parser.add_argument('--accumulate', type=int, default=1,
+                        help='micro-batches of --batchsize per optimizer update')
+    parser.add_argument('--bn_effective_batch', type=strtobool, default='false',
+                        help='batch normalization statistics over all the micro-batches')
     parser.add_argument('--out', '-o', type=str, default='result')
     parser.add_argument('--epoch', '-e', type=int, default=250)
     parser.add_argument('--model_filename','-m', type=str, default='model.npz')
     parser.add_argument('--resume','-r', type=str, default='')
+    parser.add_argument('--snapshot_interval', type=int, default=10)
+    parser.add_argument('--snapshot_keep', type=int, default=3)
     parser.add_argument('--trans','-t', type=strtobool, default='true')
     parser.add_argument('--use_bn', type=strtobool, default='true')
     parser.add_argument('--residual', type=strtobool, default='false')
     parser.add_argument('--use_val','-v', type=strtobool, default='true')
+    parser.add_argument('--eval_interval', type=int, default=1)
+    parser.add_argument('--eval_subsample', type=int, default=0)
+    parser.add_argument('--eval_full_interval', type=int, default=10)
     parser.add_argument('--class_choice','-c', type=str, default='Chair')
+    parser.add_argument('--shared_memory', type=strtobool, default='false',
+                        help='share the parsed dataset with other jobs, see shared_dataset.py')
+    parser.add_argument('--timing', type=strtobool, default='false')
+    parser.add_argument('--early_stopping', type=strtobool, default='false')
+    parser.add_argument('--importance_sampling', type=strtobool, default='false')
+    parser.add_argument('--is_warmup', type=int, default=5)
+    parser.add_argument('--is_floor', type=float, default=0.2)
+    parser.add_argument('--lr_patience', type=int, default=10)
+    parser.add_argument('--stop_patience', type=int, default=30)
+    parser.add_argument('--profile', type=strtobool, default='false')
+    parser.add_argument('--curriculum_start', type=int, default=0,
+                        help='initial number of training points, 0 disables the curriculum')
+    parser.add_argument('--curriculum_epochs', type=int, default=50)
+    parser.add_argument('--chamfer_points', type=int, default=0,
+                        help='points per cloud of a stochastic training chamfer, 0 is exact')
     args = parser.parse_args()
 
+    # chainer is imported after parsing, so that --help and errors are fast
+    import chainer
+    from chainer import serializers
+    from chainer import optimizers
+    from chainer import training
+    from chainer import iterators
+    from chainer.training import extensions as E
+    from chainer.dataset.convert import concat_examples
+    from chainer.datasets.concatenated_dataset import ConcatenatedDataset
+
+    # self made
+    import models.pointnet_ae as ae
+    import dataset
+    import updaters
+    import extensions
+    import samplers
+    import devices
+
     batch_size = args.batchsize
     dropout_ratio = args.dropout_ratio
     num_point = args.num_point
+    packed = args.packed
     device = args.gpu
+    cpu_device = args.device
+    processes = args.processes
+    accumulate = args.accumulate
     out_dir = args.out
     epoch = args.epoch
     model_filename = args.model_filename
     resume = args.resume
+    snapshot_interval = args.snapshot_interval
+    snapshot_keep = args.snapshot_keep
     trans = args.trans
     use_bn = args.use_bn
     residual = args.residual
     use_val = args.use_val
+    eval_interval = args.eval_interval
+    eval_subsample = args.eval_subsample
+    eval_full_interval = args.eval_full_interval
     class_choice = args.class_choice
+    timing = args.timing
+    early_stopping = args.early_stopping
+    lr_patience = args.lr_patience
+    stop_patience = args.stop_patience
+    importance_sampling = args.importance_sampling
+    is_warmup = args.is_warmup
+    is_floor = args.is_floor
+    curriculum_start = args.curriculum_start
+    curriculum_epochs = args.curriculum_epochs
+    chamfer_points = args.chamfer_points
 
     trans_lam1 = 0.001
     trans_lam2 = 0.001
@@ -72,32 +125,108 @@ def main():
           .format(trans, use_bn, dropout_ratio))
     model = ae.PointNetAE(out_dim=out_dim, in_dim=in_dim, middle_dim=middle_dim, dropout_ratio=dropout_ratio, use_bn=use_bn,
                           trans=trans, trans_lam1=trans_lam1, trans_lam2=trans_lam2, residual=residual,output_points=num_point)
+    if chamfer_points > 0:
+        model.chamfer_points = chamfer_points
+
+    if batch_size == 'auto':
+        # estimate and probe the largest batch fitting the budget
+        import planner
+        budget = args.memory_budget * 2 ** 20 or planner.available_memory(device) * 0.8
+        batch_size = planner.plan_batch_size(model, num_point, budget / processes, gpu=device) * processes
+        if batch_size < 1:
+            raise ValueError('a batch of 1 doesn\'t fit in {:.0f} MB'.format(budget / 2 ** 20))
+        print('batch size {}'.format(batch_size))
+    else:
+        batch_size = int(batch_size)
 
     print("Dataset setting... num_point={} use_val={}".format(num_point, use_val))
     # Dataset preparation
 
-    train = dataset.ChainerPointCloudDatasetDefault(split="train", class_choice=[class_choice],num_point=num_point)
+    if timing and accumulate > 1:
+        raise ValueError('--timing is not supported with --accumulate')
+    if importance_sampling and args.bn_effective_batch:
+        # the losses of the statistics passes can't be paired with the batches
+        raise ValueError('--importance_sampling is not supported with --bn_effective_batch')
+    if packed and args.shared_memory:
+        raise ValueError('--packed is not supported with --shared_memory')
+    if packed and curriculum_start > 0:
+        raise ValueError('--packed is not supported with --curriculum_start')
+    if args.shared_memory:
+        # parsed once and shared read-only by the jobs on this host
+        dataset_class = dataset.ChainerPointCloudDatasetShared
+    else:
+        dataset_class = dataset.ChainerPointCloudDatasetDefault
+    dataset_kwargs = {'variable_size': True} if packed else {}
+    train = dataset_class(split="train", class_choice=[class_choice],num_point=num_point,**dataset_kwargs)
     if use_val:
-        val = dataset.ChainerPointCloudDatasetDefault(split="val", class_choice=[class_choice],num_point=num_point)
-        val_iter = iterators.SerialIterator(ConcatenatedDataset(*([val])), batch_size, repeat=False, shuffle=False)
-    train_iter = iterators.SerialIterator(ConcatenatedDataset(*([train])), batch_size)
+        val = dataset_class(split="val", class_choice=[class_choice],num_point=num_point,**dataset_kwargs)
+    if processes > 1:
+        if device >= 0:
+            raise ValueError('--processes is only supported on CPU')
+        if cpu_device != 'numpy':
+            raise ValueError('--processes is only supported with --device numpy')
+        if accumulate > 1:
+            raise ValueError('--accumulate is not supported with --processes')
+        if curriculum_start > 0:
+            raise ValueError('--curriculum_start is not supported with --processes')
+        if importance_sampling:
+            raise ValueError('--importance_sampling is not supported with --processes')
+        if batch_size < processes or batch_size % processes:
+            raise ValueError('--batchsize must be a multiple of --processes')
+        # each process trains on its own shard with a part of the batch
+        shards = chainer.datasets.split_dataset_n_random(train, processes)
+        train_iters = [iterators.SerialIterator(ConcatenatedDataset(*([shard])), batch_size // processes)
+                       for shard in shards]
+        train_iter = train_iters[0]
+    elif importance_sampling:
+        # high loss shapes are sampled more often with importance weights
+        train_iter = samplers.ImportanceSamplingIterator(ConcatenatedDataset(*([train])), batch_size, model,
+                                                         warmup=is_warmup, floor=is_floor)
+    else:
+        train_iter = iterators.SerialIterator(ConcatenatedDataset(*([train])), batch_size)
 
-    print("GPU setting...")
-    # gpu setting
-    if(device >= 0):
-        print('using gpu {}'.format(device))
-        chainer.backends.cuda.get_device_from_id(device).use()
-        model.to_gpu()
+    print("Device setting...")
+    # gpu or iDeep setting
+    backend = devices.setup_device(model, device, cpu_device)
+    print('using {}'.format('gpu {}'.format(device) if device >= 0 else backend))
+    # the updaters would move an iDeep model back to NumPy
+    target_device = devices.updater_device(device, backend)
 
     # Optimizer
     optimizer = optimizers.Adam()
     optimizer.setup(model)
 
     # traning
-    converter = concat_examples
-    updater = training.StandardUpdater(
-        train_iter, optimizer, device=device, converter=converter)
-    trainer = training.Trainer(updater, (epoch, 'epoch'), out=out_dir)
+    if packed:
+        # compute scales with the real number of points of the clouds
+        converter = dataset.concat_packed
+    else:
+        converter = concat_examples
+    if processes > 1:
+        print('using {} cpu processes'.format(processes))
+        updater = updaters.CPUParallelUpdater(
+            train_iters, optimizer, converter=converter)
+    elif accumulate > 1:
+        print('effective batch size {}'.format(batch_size * accumulate))
+        updater = updaters.GradientAccumulationUpdater(
+            train_iter, optimizer, accumulate=accumulate, device=target_device, converter=converter,
+            bn_effective_batch=args.bn_effective_batch)
+    elif timing:
+        updater = updaters.InstrumentedUpdater(
+            train_iter, optimizer, device=target_device, converter=converter)
+    else:
+        updater = training.StandardUpdater(
+            train_iter, optimizer, device=target_device, converter=converter)
+    if early_stopping:
+        if not use_val:
+            raise ValueError('--early_stopping needs --use_val')
+        plateau = extensions.PlateauEarlyStopping(
+            epoch, patience=lr_patience, stop_patience=stop_patience)
+        trainer = training.Trainer(updater, plateau.stop_trigger(), out=out_dir)
+        stopped = lambda: plateau.stopped
+    else:
+        trainer = training.Trainer(updater, (epoch, 'epoch'), out=out_dir)
+        stopped = None
 
     from chainerex.training.extensions import schedule_optimizer_value
     from chainer.training.extensions import observe_value
@@ -106,31 +235,67 @@ def main():
     trainer.extend(observe_value(
         observation_key,
         lambda trainer: trainer.updater.get_optimizer('main').alpha))
-    trainer.extend(schedule_optimizer_value(
-        [10, 20, 100, 150, 200, 230],
-        [0.003, 0.001, 0.0003, 0.0001, 0.00003, 0.00001]))
+    if early_stopping:
+        # lr is dropped on validation plateaus instead of fixed epochs
+        trainer.extend(plateau)
+    else:
+        trainer.extend(schedule_optimizer_value(
+            [10, 20, 100, 150, 200, 230],
+            [0.003, 0.001, 0.0003, 0.0001, 0.00003, 0.00001]))
 
+    if curriculum_start > 0:
+        # fewer points in the early epochs, ramped up to num_point
+        trainer.extend(extensions.PointCurriculum(
+            model, curriculum_start, num_point, curriculum_epochs))
+
+    print_entries = ['epoch', 'main/loss', 'main/dist_loss', 'main/trans_loss1',
+                     'main/trans_loss2']
     if use_val:
-        trainer.extend(E.Evaluator(val_iter, model,
-                                   converter=converter, device=device))
-        trainer.extend(E.PrintReport(
-            ['epoch', 'main/loss','main/dist_loss', 'main/trans_loss1',
-             'main/trans_loss2', 'validation/main/loss','validation/main/dist_loss',
-             'validation/main/trans_loss1', 'validation/main/trans_loss2',
-             'lr', 'elapsed_time']))
-    else:
-        trainer.extend(E.PrintReport(
-            ['epoch', 'main/loss', 'main/dist_loss', 'main/trans_loss1',
-             'main/trans_loss2', 'lr', 'elapsed_time']))
-    trainer.extend(E.snapshot(), trigger=(epoch, 'epoch'))
+        # val batches are converted once and kept on the device
+        trainer.extend(extensions.CachedEvaluator(ConcatenatedDataset(*([val])), model, batch_size,
+                                                  converter=converter, device=target_device,
+                                                  subsample=eval_subsample,
+                                                  full_interval=eval_full_interval),
+                       trigger=extensions.interval_or_last_trigger(eval_interval, epoch))
+        print_entries += ['validation/main/loss','validation/main/dist_loss',
+                          'validation/main/trans_loss1', 'validation/main/trans_loss2']
+        if eval_subsample > 0:
+            print_entries += ['validation_subset/main/dist_loss']
+    print_entries += ['lr', 'elapsed_time']
+    if curriculum_start > 0:
+        print_entries += ['train_points']
+    if timing and processes == 1:
+        # all time/* entries are written to the log
+        print_entries += ['time/data', 'time/convert', 'time/encoder', 'time/decoder',
+                          'time/loss', 'time/backward', 'time/update', 'throughput/samples',
+                          'memory/rss']
+    trainer.extend(E.PrintReport(print_entries))
+    # every snapshot_interval epochs and at the last epoch, also on an early
+    # stop since the snapshot runs after PlateauEarlyStopping
+    trainer.extend(extensions.AsyncSnapshot(keep=snapshot_keep),
+                   trigger=extensions.interval_or_last_trigger(snapshot_interval, epoch, stopped))
     trainer.extend(E.LogReport())
     trainer.extend(E.ProgressBar(update_interval=10))
 
-    resume = ''
+    # the updater and the evaluator must have left the iDeep arrays alone
+    devices.check_backend(model, backend)
+
+    if resume == 'auto':
+        resume = extensions.latest_snapshot(out_dir)
     if resume:
-        serializers.load_npz(resume, trainer)
+        print('resume from {}'.format(resume))
+        extensions.load_snapshot(resume, trainer)
     print("Traning start.")
-    trainer.run()
+    if args.profile:
+        # per function time and output bytes of the main process
+        import profiler
+        prof = profiler.FunctionProfiler()
+        with prof:
+            trainer.run()
+        prof.print_report()
+        prof.save(out_dir)
+    else:
+        trainer.run()
 
     # --- save classifier ---
     # protocol = args.protocol
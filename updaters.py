@@ -0,0 +1,520 @@
+import multiprocessing
+import os
+import resource
+import time
+import traceback
+
+import numpy as np
+
+import chainer
+from chainer import backends
+from chainer import reporter as reporter_module
+from chainer import training
+from chainer.dataset.convert import concat_examples
+
+
+def _forward(model, in_arrays):
+    if isinstance(in_arrays, tuple):
+        return model(*in_arrays)
+    elif isinstance(in_arrays, dict):
+        return model(**in_arrays)
+    else:
+        return model(in_arrays)
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2. ** 20
+    except (IOError, OSError, ValueError):
+        # peak RSS, reported in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2. ** 10
+
+
+def _shared_array(ctx, shape):
+    raw = ctx.RawArray('f', int(np.prod(shape)))
+    return np.frombuffer(raw, dtype=np.float32).reshape(shape)
+
+
+def _sorted_params(link):
+    return [param for _, param in sorted(link.namedparams())]
+
+
+def _write_params(params, dst):
+    offset = 0
+    for param in params:
+        dst[offset:offset + param.size] = param.array.ravel()
+        offset += param.size
+
+
+def _read_params(params, src):
+    offset = 0
+    for param in params:
+        param.array[...] = src[offset:offset + param.size].reshape(param.shape)
+        offset += param.size
+
+
+def _write_grads(params, dst):
+    offset = 0
+    for param in params:
+        if param.grad is None:
+            dst[offset:offset + param.size] = 0
+        else:
+            dst[offset:offset + param.size] = param.grad.ravel()
+        offset += param.size
+
+
+def _read_grads(params, src):
+    offset = 0
+    for param in params:
+        grad = src[offset:offset + param.size].reshape(param.shape)
+        if param.grad is None:
+            param.grad = grad.astype(param.dtype)
+        else:
+            param.grad[...] = grad
+        offset += param.size
+
+
+def _sorted_stats(link):
+    # float persistents, i.e. the BatchNormalization running averages
+    stats = []
+    for _, l in sorted(link.namedlinks()):
+        for name in sorted(l._persistent):
+            value = getattr(l, name)
+            if isinstance(value, np.ndarray) and value.dtype.kind == 'f':
+                stats.append(value)
+    return stats
+
+
+def _write_stats(stats, dst):
+    offset = 0
+    for value in stats:
+        dst[offset:offset + value.size] = value.ravel()
+        offset += value.size
+
+
+def _read_stats(stats, src):
+    offset = 0
+    for value in stats:
+        value[...] = src[offset:offset + value.size].reshape(value.shape)
+        offset += value.size
+
+
+class _Worker(object):
+
+    def __init__(self, proc_id, pipe, model, converter,
+                 params_buf, grads_buf, stats_buf, worker_stats_buf):
+        self.proc_id = proc_id
+        self.pipe = pipe
+        self.model = model
+        self.converter = converter
+        self.params_buf = params_buf
+        self.grads_buf = grads_buf
+        self.stats_buf = stats_buf
+        self.worker_stats_buf = worker_stats_buf
+
+    def run(self):
+        params = _sorted_params(self.model)
+        while True:
+            job = self.pipe.recv()
+            if job == 'finalize':
+                break
+            # job == ('update', batch)
+            try:
+                _read_params(params, self.params_buf)
+                _read_stats(_sorted_stats(self.model), self.stats_buf)
+                in_arrays = self.converter(job[1])
+                self.model.cleargrads()
+                loss = _forward(self.model, in_arrays)
+                loss.backward()
+                _write_grads(params, self.grads_buf[self.proc_id])
+                _write_stats(_sorted_stats(self.model),
+                             self.worker_stats_buf[self.proc_id])
+            except Exception:
+                # the master raises it, instead of waiting forever
+                self.pipe.send(('error', traceback.format_exc()))
+                break
+            self.pipe.send(('done', None))
+
+
+class CPUParallelUpdater(training.updaters.StandardUpdater):
+    """Data parallel updater using CPU processes
+
+    Each process owns a replica of the target link and is sent the batches
+    of one of the given iterators (a shard of the training set). The
+    iterators stay in the master process, so they are saved in snapshots.
+    Every iteration the gradients
+    of all replicas are averaged through shared memory and only the master
+    process runs the optimizer, then the new parameters are published back
+    to the workers. The BatchNormalization running averages of the
+    replicas are averaged the same way, so the master model evaluates and
+    snapshots with the statistics of the whole batch.
+
+    Workers are forked on the first update, so set ``OMP_NUM_THREADS``
+    (or similar) to keep BLAS threads from oversubscribing the cores.
+
+    Args:
+        iterators (list): one iterator per process, the first one is used
+            by the master process.
+        optimizer (chainer.Optimizer): optimizer of the master model.
+        converter: converter function applied to each mini-batch.
+    """
+
+    def __init__(self, iterators, optimizer, converter=concat_examples):
+        super(CPUParallelUpdater, self).__init__(
+            iterators[0], optimizer, converter=converter)
+        self._sub_iterators = iterators[1:]
+        self._n_processes = len(iterators)
+        self._initialized = False
+        self._pipes = []
+        self._workers = []
+
+    def setup_workers(self):
+        if self._initialized:
+            return
+        self._initialized = True
+
+        ctx = multiprocessing.get_context('fork')
+        model = self.get_optimizer('main').target
+        self._params = _sorted_params(model)
+        size = sum(param.size for param in self._params)
+        self._params_buf = _shared_array(ctx, (size,))
+        self._grads_buf = _shared_array(ctx, (self._n_processes - 1, size))
+        _write_params(self._params, self._params_buf)
+        stats_size = sum(value.size for value in _sorted_stats(model))
+        self._stats_buf = _shared_array(ctx, (stats_size,))
+        self._worker_stats_buf = _shared_array(ctx, (self._n_processes - 1, stats_size))
+        _write_stats(_sorted_stats(model), self._stats_buf)
+
+        for proc_id in range(len(self._sub_iterators)):
+            pipe, worker_pipe = ctx.Pipe()
+            # the forked child gets its own copy of ``model``
+            worker = _Worker(proc_id, worker_pipe, model,
+                             self.converter, self._params_buf,
+                             self._grads_buf, self._stats_buf,
+                             self._worker_stats_buf)
+            process = ctx.Process(target=worker.run)
+            process.daemon = True
+            process.start()
+            # only the child keeps its end, so recv() fails if it dies
+            worker_pipe.close()
+            self._pipes.append(pipe)
+            self._workers.append(process)
+
+    def update_core(self):
+        self.setup_workers()
+        for pipe, iterator in zip(self._pipes, self._sub_iterators):
+            pipe.send(('update', iterator.next()))
+
+        optimizer = self.get_optimizer('main')
+        model = optimizer.target
+        batch = self.get_iterator('main').next()
+        in_arrays = self.converter(batch)
+        model.cleargrads()
+        loss = _forward(model, in_arrays)
+        loss.backward()
+
+        for proc_id, pipe in enumerate(self._pipes):
+            try:
+                status, message = pipe.recv()
+            except EOFError:
+                raise RuntimeError('worker {} exited'.format(proc_id + 1))
+            if status == 'error':
+                raise RuntimeError('worker {} failed:\n{}'.format(proc_id + 1, message))
+
+        # allreduce: average the master gradient with the shared slots
+        grads = np.empty(self._params_buf.shape, dtype=np.float32)
+        _write_grads(self._params, grads)
+        grads += self._grads_buf.sum(axis=0)
+        grads /= self._n_processes
+        _read_grads(self._params, grads)
+
+        # every replica started from the same running averages
+        stats = _sorted_stats(model)
+        averaged = np.empty(self._stats_buf.shape, dtype=np.float32)
+        _write_stats(stats, averaged)
+        averaged += self._worker_stats_buf.sum(axis=0)
+        averaged /= self._n_processes
+        _read_stats(stats, averaged)
+
+        optimizer.update()
+        _write_params(self._params, self._params_buf)
+        _write_stats(stats, self._stats_buf)
+
+    def serialize(self, serializer):
+        super(CPUParallelUpdater, self).serialize(serializer)
+        for i, iterator in enumerate(self._sub_iterators):
+            iterator.serialize(serializer['iterator:worker{}'.format(i + 1)])
+
+    def finalize(self):
+        for pipe in self._pipes:
+            try:
+                pipe.send('finalize')
+            except (BrokenPipeError, OSError):
+                # the worker already exited
+                pass
+        for process in self._workers:
+            process.join()
+        self._pipes = []
+        self._workers = []
+        super(CPUParallelUpdater, self).finalize()
+
+
+class InstrumentedUpdater(training.updaters.StandardUpdater):
+    """Updater reporting the time spent in each phase of an iteration
+
+    Reports ``time/data`` (iterator), ``time/convert`` (converter),
+    ``time/forward``, ``time/backward`` and ``time/update`` (optimizer) in
+    seconds, as well as ``time/encoder``, ``time/decoder`` and
+    ``time/loss`` when the target link records them in its
+    ``phase_times`` dict like ``PointNetAE`` does. Throughput is reported
+    as ``throughput/samples`` and ``throughput/points`` per second, and
+    the resident set size of the process as ``memory/rss`` in MB.
+
+    With ``enabled=False`` it behaves exactly like StandardUpdater.
+    """
+
+    def __init__(self, iterator, optimizer, converter=concat_examples,
+                 device=None, loss_func=None, enabled=True):
+        super(InstrumentedUpdater, self).__init__(
+            iterator, optimizer, converter=converter, device=device,
+            loss_func=loss_func)
+        self.enabled = enabled
+
+    def _now(self):
+        # Chainer 7 keeps the device as a Device object, not a GPU id
+        if isinstance(self.device, chainer.backend.GpuDevice):
+            backends.cuda.Stream.null.synchronize()
+        return time.time()
+
+    def update_core(self):
+        if not self.enabled:
+            return super(InstrumentedUpdater, self).update_core()
+
+        optimizer = self.get_optimizer('main')
+        loss_func = self.loss_func or optimizer.target
+        target = optimizer.target
+        phase_times = {}
+        if hasattr(target, 'phase_times'):
+            target.phase_times = phase_times
+
+        t0 = self._now()
+        batch = self.get_iterator('main').next()
+        t1 = self._now()
+        in_arrays = self.converter(batch, self.device)
+        t2 = self._now()
+        target.cleargrads()
+        loss = _forward(loss_func, in_arrays)
+        t3 = self._now()
+        loss.backward(loss_scale=self.loss_scale)
+        del loss
+        t4 = self._now()
+        optimizer.update()
+        t5 = self._now()
+
+        if hasattr(target, 'phase_times'):
+            target.phase_times = None
+
+        elapsed = t5 - t0
+        if isinstance(in_arrays, dict):
+            # packed batch, the point axis holds the points of every cloud
+            points = in_arrays['x'].shape[2]
+        else:
+            x = in_arrays[0] if isinstance(in_arrays, tuple) else in_arrays
+            points = len(batch) * (x.shape[2] if x.ndim > 2 else 1)
+        observation = {
+            'time/data': t1 - t0,
+            'time/convert': t2 - t1,
+            'time/forward': t3 - t2,
+            'time/backward': t4 - t3,
+            'time/update': t5 - t4,
+            'time/iteration': elapsed,
+            'throughput/samples': len(batch) / elapsed,
+            'throughput/points': points / elapsed,
+            'memory/rss': _rss_mb(),
+        }
+        for name, seconds in phase_times.items():
+            observation['time/' + name] = seconds
+        chainer.report(observation)
+
+
+class _EffectiveBatchNormalization(object):
+    """Batch normalization statistics over several micro-batches
+
+    ``collect()`` makes every BatchNormalization link of ``target`` add the
+    mean and the mean of squares of its inputs. In the first collection
+    the links normalize with the statistics of their micro-batch without
+    touching the running averages, and in
+    the following ones with the statistics of the previous collection.
+    Each collection makes the statistics of one more layer in depth equal
+    to the effective batch ones, since the inputs of a layer are normalized
+    with the effective batch statistics once the ones of all the layers
+    before it are, and ``converged()`` tells when a collection gave back
+    the statistics it normalized with. ``apply()`` then makes them normalize with the
+    collected statistics through ``fixed_batch_normalization``, so the
+    gradients flow to the inputs, gamma and beta but not through the
+    statistics, and updates their running averages once.
+    """
+
+    def __init__(self, target):
+        self.links = [link for link in target.links()
+                      if isinstance(link, chainer.links.BatchNormalization)]
+        self.stats = {}
+        self.previous = {}
+
+    def _mean_var(self, link):
+        total, total_sq, count = self.stats[id(link)]
+        mean = total / count
+        var = link.xp.maximum(total_sq / count - mean * mean, 0)
+        return mean.astype(link.avg_mean.dtype), var.astype(link.avg_var.dtype), count
+
+    def collect(self):
+        previous = {}
+        for link in self.links:
+            if id(link) in self.stats:
+                previous[id(link)] = self._mean_var(link)[:2]
+        self.previous = previous
+        self.stats = {}
+        for link in self.links:
+            link.forward = self._collecting(link, previous.get(id(link)))
+
+    def converged(self):
+        for link in self.links:
+            if id(link) not in self.previous:
+                return False
+            xp = link.xp
+            mean, var = self._mean_var(link)[:2]
+            previous_mean, previous_var = self.previous[id(link)]
+            if not (xp.allclose(mean, previous_mean) and xp.allclose(var, previous_var)):
+                return False
+        return True
+
+    def _collecting(self, link, previous):
+        stats = self.stats[id(link)] = [0, 0, 0]
+
+        def collecting(x, **kwargs):
+            a = x.array if isinstance(x, chainer.Variable) else x
+            axis = (0,) + tuple(range(2, a.ndim))
+            stats[0] = stats[0] + a.sum(axis=axis)
+            stats[1] = stats[1] + (a * a).sum(axis=axis)
+            stats[2] += a.size // a.shape[1]
+            if previous is None:
+                # no running_mean/running_var, they are updated by apply()
+                return chainer.functions.batch_normalization(
+                    x, link.gamma, link.beta, eps=link.eps, axis=link.axis)
+            return chainer.functions.fixed_batch_normalization(
+                x, link.gamma, link.beta, previous[0], previous[1], link.eps)
+        return collecting
+
+    def apply(self):
+        for link in self.links:
+            mean, var, count = self._mean_var(link)
+            # running averages like BatchNormalization, once per step
+            decay = link.decay
+            link.avg_mean *= decay
+            link.avg_mean += (1 - decay) * mean
+            link.avg_var *= decay
+            link.avg_var += (1 - decay) * var * count / max(count - 1, 1)
+            link.forward = self._fixed(link, mean, var)
+
+    @staticmethod
+    def _fixed(link, mean, var):
+        def fixed(x, **kwargs):
+            return chainer.functions.fixed_batch_normalization(
+                x, link.gamma, link.beta, mean, var, link.eps)
+        return fixed
+
+    def restore(self):
+        for link in self.links:
+            if 'forward' in link.__dict__:
+                del link.forward
+
+
+class GradientAccumulationUpdater(training.updaters.StandardUpdater):
+    """Updater accumulating gradients over several micro-batches
+
+    Every update draws ``accumulate`` batches from the iterator, runs the
+    forward and backward of each with its loss divided by ``accumulate``
+    and then a single optimizer update, so the gradient is the one of the
+    mean loss over the effective batch of ``accumulate`` times the batch
+    size of the iterator. The values the target reports are averaged over
+    the micro-batches.
+
+    With ``bn_effective_batch=True``, forward passes without backprop over
+    all the micro-batches first collect the batch normalization statistics
+    of the effective batch, and the micro-batches are then normalized with
+    them instead of their own (see _EffectiveBatchNormalization). Each pass
+    makes the statistics of one more layer in depth exact, so by default
+    the passes go on until the statistics stop changing, at most one more
+    than the number of BatchNormalization links. The gradients don't flow
+    through the statistics, so the backward is not the one of a forward
+    over the effective batch.
+
+    Args:
+        iterator: iterator of micro-batches.
+        optimizer: optimizer to update with.
+        accumulate (int): number of micro-batches per update.
+        converter: converter of the micro-batches.
+        device: device to send the micro-batches to.
+        loss_func: loss function, the target of the optimizer by default.
+        bn_effective_batch (bool): use batch normalization statistics of
+            the effective batch.
+        bn_passes (int): maximum number of passes collecting the
+            statistics, ``None`` for one more than the number of
+            BatchNormalization links of the target.
+    """
+
+    def __init__(self, iterator, optimizer, accumulate=1, converter=concat_examples,
+                 device=None, loss_func=None, bn_effective_batch=False, bn_passes=None):
+        super(GradientAccumulationUpdater, self).__init__(
+            iterator, optimizer, converter=converter, device=device,
+            loss_func=loss_func)
+        self.accumulate = accumulate
+        self.bn_effective_batch = bn_effective_batch
+        self.bn_passes = bn_passes
+
+    def update_core(self):
+        optimizer = self.get_optimizer('main')
+        loss_func = self.loss_func or optimizer.target
+        target = optimizer.target
+        iterator = self.get_iterator('main')
+
+        if self.bn_effective_batch:
+            # all micro-batches are needed before the first backward
+            micro_batches = [self.converter(iterator.next(), self.device)
+                             for _ in range(self.accumulate)]
+            bn = _EffectiveBatchNormalization(target)
+            passes = self.bn_passes
+            if passes is None:
+                passes = len(bn.links) + 1
+            try:
+                for _ in range(passes):
+                    bn.collect()
+                    with chainer.no_backprop_mode(), reporter_module.report_scope({}):
+                        for in_arrays in micro_batches:
+                            _forward(loss_func, in_arrays)
+                    if bn.converged():
+                        break
+                bn.apply()
+                self._accumulate(optimizer, loss_func, iter(micro_batches))
+            finally:
+                bn.restore()
+        else:
+            micro_batches = (self.converter(iterator.next(), self.device)
+                             for _ in range(self.accumulate))
+            self._accumulate(optimizer, loss_func, micro_batches)
+        optimizer.update()
+
+    def _accumulate(self, optimizer, loss_func, micro_batches):
+        optimizer.target.cleargrads()
+        summary = reporter_module.DictSummary()
+        for in_arrays in micro_batches:
+            observation = {}
+            with reporter_module.report_scope(observation):
+                loss = _forward(loss_func, in_arrays)
+            summary.add(observation)
+            # gradients add up over the backward calls
+            (loss / self.accumulate).backward(loss_scale=self.loss_scale)
+            del loss
+        reporter_module.report(summary.compute_mean())
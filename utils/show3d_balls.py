@@ -1,9 +1,9 @@
 """ Original Author: Haoqiang Fan """
 import numpy as np
 import ctypes as ct
-import cv2
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 showsz=800
 mousex,mousey=0.5,0.5
@@ -16,14 +16,45 @@ def onmouse(*args):
     mousex=x/float(showsz)
     mousey=y/float(showsz)
     changed=True
-cv2.namedWindow('show3d')
-cv2.moveWindow('show3d',0,0)
-cv2.setMouseCallback('show3d',onmouse)
+window_ready=False
+def init_window():
+    # the window is only created by showpoints, so that the offscreen
+    # render functions work on headless machines
+    global window_ready
+    import cv2
+    if not window_ready:
+        cv2.namedWindow('show3d')
+        cv2.moveWindow('show3d',0,0)
+        cv2.setMouseCallback('show3d',onmouse)
+        window_ready=True
 
-dll=np.ctypeslib.load_library(os.path.join(BASE_DIR, 'render_balls_so'),'.')
+dll=None
+def load_dll():
+    # cv2 and the render library are loaded on first use
+    global dll
+    if dll is None:
+        dll=np.ctypeslib.load_library(os.path.join(BASE_DIR, 'render_balls_so'),'.')
+    return dll
+
+def render_ball(show,ixyz,c0,c1,c2,ballradius):
+    # ctypes releases the GIL during the call, so this can run on threads
+    ixyz=np.require(ixyz,'int32','C')
+    load_dll().render_ball(
+        ct.c_int(show.shape[0]),
+        ct.c_int(show.shape[1]),
+        show.ctypes.data_as(ct.c_void_p),
+        ct.c_int(ixyz.shape[0]),
+        ixyz.ctypes.data_as(ct.c_void_p),
+        c0.ctypes.data_as(ct.c_void_p),
+        c1.ctypes.data_as(ct.c_void_p),
+        c2.ctypes.data_as(ct.c_void_p),
+        ct.c_int(ballradius)
+    )
 
 def showpoints(xyz,c_gt=None, c_pred = None ,waittime=0,showrot=False,magnifyBlue=0,freezerot=False,background=(0,0,0),normalizecolor=True,ballradius=10):
     global showsz,mousex,mousey,zoom,changed
+    import cv2
+    init_window()
     xyz=xyz-xyz.mean(axis=0)
     radius=((xyz**2).sum(axis=-1)**0.5).max()
     xyz/=(radius*2.2)/showsz
@@ -73,17 +104,7 @@ def showpoints(xyz,c_gt=None, c_pred = None ,waittime=0,showrot=False,magnifyBlu
 
         ixyz=nxyz.astype('int32')
         show[:]=background
-        dll.render_ball(
-            ct.c_int(show.shape[0]),
-            ct.c_int(show.shape[1]),
-            show.ctypes.data_as(ct.c_void_p),
-            ct.c_int(ixyz.shape[0]),
-            ixyz.ctypes.data_as(ct.c_void_p),
-            c0.ctypes.data_as(ct.c_void_p),
-            c1.ctypes.data_as(ct.c_void_p),
-            c2.ctypes.data_as(ct.c_void_p),
-            ct.c_int(ballradius)
-        )
+        render_ball(show,ixyz,c0,c1,c2,ballradius)
 
         if magnifyBlue>0:
             show[:,:,0]=np.maximum(show[:,:,0],np.roll(show[:,:,0],1,axis=0))
@@ -157,6 +178,75 @@ def showpoints(xyz,c_gt=None, c_pred = None ,waittime=0,showrot=False,magnifyBlu
         if waittime!=0:
             break
     return cmd
+
+def render_points(xyz,size=256,ballradius=3,color=(255,255,255),background=(0,0,0),xangle=0.0,yangle=0.0,zoom=1.0):
+    """ Render one point cloud offscreen.
+        Input:
+          Nx3 array, point cloud
+          color: RGB tuple or Nx3 array of per point RGB colors
+          background: RGB tuple
+        Return:
+          size x size x 3 uint8 BGR image
+    """
+    xyz=np.asarray(xyz,dtype='float64')
+    xyz=xyz-xyz.mean(axis=0)
+    radius=((xyz**2).sum(axis=-1)**0.5).max()
+    xyz=xyz/((radius*2.2+1e-14)/size)
+    color=np.broadcast_to(np.asarray(color,dtype='float32'),(len(xyz),3))
+    # render_ball writes c0 to G, c1 to R and c2 to B of the BGR image
+    c0=np.require(color[:,1],'float32','C')
+    c1=np.require(color[:,0],'float32','C')
+    c2=np.require(color[:,2],'float32','C')
+    rotmat=np.array([
+        [1.0,0.0,0.0],
+        [0.0,np.cos(xangle),-np.sin(xangle)],
+        [0.0,np.sin(xangle),np.cos(xangle)],
+        ]).dot(np.array([
+        [np.cos(yangle),0.0,-np.sin(yangle)],
+        [0.0,1.0,0.0],
+        [np.sin(yangle),0.0,np.cos(yangle)],
+        ]))*zoom
+    ixyz=(xyz.dot(rotmat)+[size/2,size/2,0]).astype('int32')
+    show=np.empty((size,size,3),dtype='uint8')
+    show[:]=tuple(background)[::-1]
+    render_ball(show,ixyz,c0,c1,c2,ballradius)
+    return show
+
+def render_grid(rows,size=256,**kwargs):
+    """ Render a grid of point clouds offscreen.
+        Input:
+          rows: list of rows, each a list of Nx3 arrays
+            (e.g. [[input0, reconstruction0], [input1, reconstruction1]])
+        Return:
+          (len(rows)*size) x (ncols*size) x 3 uint8 image
+    """
+    ncols=max(len(row) for row in rows)
+    grid=np.zeros((len(rows)*size,ncols*size,3),dtype='uint8')
+    for i,row in enumerate(rows):
+        for j,xyz in enumerate(row):
+            grid[i*size:(i+1)*size,j*size:(j+1)*size]=render_points(xyz,size=size,**kwargs)
+    return grid
+
+def save_reconstruction_grids(inputs,outputs,out_dir,rows_per_image=8,num_threads=8,prefix='recon',**kwargs):
+    """ Render input vs reconstruction pairs into PNG grids on a thread pool.
+        Input:
+          inputs, outputs: BxNx3 arrays (or lists of Nx3 arrays)
+          rows_per_image: number of pairs per PNG
+        Return:
+          list of written PNG paths
+    """
+    import cv2
+    assert len(inputs)==len(outputs)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    def work(start):
+        rows=[[inputs[k],outputs[k]] for k in range(start,min(start+rows_per_image,len(inputs)))]
+        path=os.path.join(out_dir,'%s_%05d.png'%(prefix,start//rows_per_image))
+        cv2.imwrite(path,render_grid(rows,**kwargs))
+        return path
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        return list(executor.map(work,range(0,len(inputs),rows_per_image)))
+
 if __name__=='__main__':
     np.random.seed(100)
     showpoints(np.random.randn(2500,3))